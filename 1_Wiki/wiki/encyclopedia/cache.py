@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+# Size in bytes of each stored value and total size, by cache name
+# (shared between threads like the LocMemCache store itself)
+_sizes = {}
+_usage = {}
+
+
+class LRUCache(LocMemCache):
+    """
+    Local memory cache bounded by the total size of its values (MAX_BYTES option)
+    rather than only by their number: least recently used keys are evicted first.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._name = name
+        self._max_bytes = int(params.get("OPTIONS", {}).get("MAX_BYTES", 32 * 1024 * 1024))
+        self._sizes = _sizes.setdefault(name, {})
+        _usage.setdefault(name, 0)
+
+    @property
+    def usage(self):
+        """
+        Total size in bytes of the cached values.
+        """
+        return _usage[self._name]
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        size = len(value)
+        if size > self._max_bytes:
+            # would evict the whole cache for a single value
+            return
+        # most recently used keys are kept at the beginning of the store
+        while self._cache and _usage[self._name] + size > self._max_bytes:
+            self._delete(next(reversed(self._cache)))
+        super()._set(key, value, timeout)
+        self._sizes[key] = size
+        _usage[self._name] += size
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._clear()
+        else:
+            for i in range(len(self._cache) // self._cull_frequency):
+                self._delete(next(reversed(self._cache)))
+
+    def _delete(self, key):
+        deleted = super()._delete(key)
+        if deleted:
+            _usage[self._name] -= self._sizes.pop(key)
+        return deleted
+
+    def _clear(self):
+        self._cache.clear()
+        self._expire_info.clear()
+        self._sizes.clear()
+        _usage[self._name] = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+
+class BlockCache:
+    """
+    Process-level cache of rendered Markdown blocks, keyed by the blocks themselves
+    (their hash) and bounded by the WIKI_BLOCK_CACHE_BYTES setting, least recently
+    used blocks being evicted first.
+
+    Blocks are small and many: unlike the "wiki" cache, values are kept as they
+    are, as pickling them would cost more than rendering them again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # block -> (HTML, size), most recently used last
+        self._blocks = OrderedDict()
+        self.usage = 0
+
+    def get(self, block):
+        with self._lock:
+            value = self._blocks.get(block)
+            if value is None:
+                return None
+            self._blocks.move_to_end(block)
+            return value[0]
+
+    def set(self, block, html):
+        # approximate size of the source and HTML characters
+        size = sum(map(len, block.lines)) + len(html)
+        max_bytes = settings.WIKI_BLOCK_CACHE_BYTES
+        if size > max_bytes:
+            return
+        with self._lock:
+            previous = self._blocks.pop(block, None)
+            if previous is not None:
+                self.usage -= previous[1]
+            while self._blocks and self.usage + size > max_bytes:
+                _, (_, evicted_size) = self._blocks.popitem(last=False)
+                self.usage -= evicted_size
+            self._blocks[block] = (html, size)
+            self.usage += size
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.usage = 0
+
+
+class NegativeCache:
+    """
+    Process-level cache of the keys known to be missing, each for WIKI_MISSING_CACHE_TTL
+    seconds, bounded to WIKI_MISSING_CACHE_SIZE keys (oldest evicted first), so that
+    repeated lookups of missing keys don't reach the storage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> expiry time, oldest first
+        self._expiry = OrderedDict()
+
+    def __contains__(self, key):
+        with self._lock:
+            expiry = self._expiry.get(key)
+            if expiry is None:
+                return False
+            if expiry < time.monotonic():
+                del self._expiry[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def add(self, key):
+        with self._lock:
+            self._expiry.pop(key, None)
+            self._expiry[key] = time.monotonic() + settings.WIKI_MISSING_CACHE_TTL
+            while len(self._expiry) > settings.WIKI_MISSING_CACHE_SIZE:
+                self._expiry.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._expiry.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._expiry.clear()
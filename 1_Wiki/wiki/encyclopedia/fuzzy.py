@@ -0,0 +1,109 @@
+import heapq
+import math
+import threading
+from collections import Counter
+
+# Minimum similarity of a title to be suggested
+THRESHOLD = 0.25
+
+
+def trigrams(text):
+    """
+    Returns the set of lowercase trigrams of a text, padded so that short texts
+    and word beginnings weigh more.
+    """
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Trigram index of the entry titles, used to find titles close to a misspelled
+    query. Only titles sharing at least a trigram with the query are scored.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # trigram -> set of titles
+        self.postings = {}
+        # title -> number of trigrams
+        self.sizes = {}
+        # titles tuple of the title index the titles were last synced with
+        self._synced_titles = None
+
+    def add(self, title):
+        grams = trigrams(title)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(title)
+        self.sizes[title] = len(grams)
+
+    def remove(self, title):
+        for gram in trigrams(title):
+            titles = self.postings.get(gram)
+            if titles is not None:
+                titles.discard(title)
+                if not titles:
+                    del self.postings[gram]
+        self.sizes.pop(title, None)
+
+    def sync(self, titles):
+        """
+        Adds and removes titles so that the index holds exactly the given titles.
+        """
+        with self._lock:
+            if titles is self._synced_titles:
+                return
+            current = set(titles)
+            for title in set(self.sizes) - current:
+                self.remove(title)
+            for title in current - set(self.sizes):
+                self.add(title)
+            self._synced_titles = titles
+
+    def search(self, query, limit=10, threshold=THRESHOLD):
+        """
+        Returns the titles most similar to the query (Jaccard similarity of their
+        trigrams), best first.
+        """
+        with self._lock:
+            grams = sorted(trigrams(query), key=lambda gram: len(self.postings.get(gram, ())))
+            # a title similar enough shares at least `required` trigrams with the query, so it
+            # is found in one of the rarest posting lists: the most common ones are only used
+            # to complete the count of the candidates
+            required = max(1, math.ceil(threshold * len(grams)))
+            rarest = len(grams) - required + 1
+            shared = Counter()
+            for gram in grams[:rarest]:
+                shared.update(self.postings.get(gram, ()))
+            for gram in grams[rarest:]:
+                titles = self.postings.get(gram, ())
+                for title in shared:
+                    if title in titles:
+                        shared[title] += 1
+            scores = ((count / (len(grams) + self.sizes[title] - count), title) for title, count in shared.items())
+            return [title for _, title in
+                    heapq.nsmallest(limit, ((-score, title) for score, title in scores if score >= threshold))]
+
+    def containing(self, text):
+        """
+        Returns the sorted titles having the text as substring, regardless of case.
+        Only titles having all the trigrams of the text are compared with it.
+        """
+        text = text.lower()
+        with self._lock:
+            if len(text) >= 3:
+                grams = sorted({text[i:i + 3] for i in range(len(text) - 2)},
+                               key=lambda gram: len(self.postings.get(gram, ())))
+                candidates = set(self.postings.get(grams[0], ()))
+                for gram in grams[1:]:
+                    candidates.intersection_update(self.postings.get(gram, ()))
+            else:
+                # shorter than a trigram: titles having a trigram containing the text
+                candidates = set()
+                for gram, titles in self.postings.items():
+                    if text in gram:
+                        candidates.update(titles)
+            return sorted(title for title in candidates if text in title.lower())
+
+
+title_trigrams = TrigramIndex()
@@ -0,0 +1,145 @@
+import difflib
+import json
+import os
+from datetime import datetime
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+# A revision stores the full content every KEYFRAME_INTERVAL revisions,
+# and the difference with the previous revision otherwise
+KEYFRAME_INTERVAL = 50
+
+
+def make_delta(old, new):
+    """
+    Returns the difference between two contents as a list of operations:
+    [start, end] copies lines start to end of the old content,
+    a string inserts new text.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j1 < j2:
+            delta.append("".join(new_lines[j1:j2]))
+    return delta
+
+
+def apply_delta(old, delta):
+    """
+    Returns the content obtained applying a delta to the old content.
+    """
+    old_lines = old.splitlines(keepends=True)
+    return "".join(op if isinstance(op, str) else "".join(old_lines[op[0]:op[1]]) for op in delta)
+
+
+def _revisions_path(title):
+    return default_storage.path(f"revisions/{title}.jsonl")
+
+
+def _read_revisions(title):
+    try:
+        with open(_revisions_path(title)) as f:
+            return [json.loads(line) for line in f if line.endswith("\n")]
+    except FileNotFoundError:
+        return []
+
+
+def _content_at(revisions, number):
+    # replay deltas from the closest previous full content
+    start = number
+    while "content" not in revisions[start]:
+        start -= 1
+    content = revisions[start]["content"]
+    for revision in revisions[start + 1:number + 1]:
+        content = apply_delta(content, revision["delta"])
+    return content
+
+
+def _append(title, revisions, content, previous):
+    revision = {"date": timezone.now().isoformat(), "size": len(content)}
+    if previous is None or len(revisions) % KEYFRAME_INTERVAL == 0:
+        revision["content"] = content
+    else:
+        revision["delta"] = make_delta(previous, content)
+    path = _revisions_path(title)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(revision) + "\n")
+    revisions.append(revision)
+
+
+def add_revision(title, old_content, content):
+    """
+    Appends a new revision of an entry to its history. If the replaced content
+    is not the last recorded revision (entry created or edited outside the wiki),
+    it is recorded first.
+    """
+    revisions = _read_revisions(title)
+    last = _content_at(revisions, len(revisions) - 1) if revisions else None
+    if old_content is not None and old_content != last:
+        _append(title, revisions, old_content, last)
+        last = old_content
+    if content != last:
+        _append(title, revisions, content, last)
+
+
+def list_revisions(title):
+    """
+    Returns the revisions of an entry, oldest first, as a list of
+    dictionaries with their number, date and size.
+    """
+    return [{
+        "number": number,
+        "date": datetime.fromisoformat(revision["date"]),
+        "size": revision["size"]
+    } for number, revision in enumerate(_read_revisions(title), start=1)]
+
+
+def get_revision(title, number):
+    """
+    Returns the content of an entry at a given revision number (starting
+    at 1), or None if there is no such revision.
+    """
+    revisions = _read_revisions(title)
+    if not 1 <= number <= len(revisions):
+        return None
+    return _content_at(revisions, number - 1)
+
+
+def diff_revision(title, number):
+    """
+    Returns the unified diff of a revision with the previous one,
+    or None if there is no such revision.
+    """
+    revisions = _read_revisions(title)
+    if not 1 <= number <= len(revisions):
+        return None
+    content = _content_at(revisions, number - 1)
+    previous = _content_at(revisions, number - 2) if number > 1 else ""
+    return _unified_diff(title, number, previous, content)
+
+
+def initial_revision(content, date):
+    """
+    Returns, for an entry without recorded revisions (never saved through
+    the wiki), its current content as revision 1, without recording it.
+    """
+    return {"number": 1, "date": date, "size": len(content)}
+
+
+def diff_initial_revision(title, content):
+    """
+    Returns the unified diff of the current content of an entry without
+    recorded revisions, as its revision 1.
+    """
+    return _unified_diff(title, 1, "", content)
+
+
+def _unified_diff(title, number, previous, content):
+    return "".join(difflib.unified_diff(previous.splitlines(keepends=True), content.splitlines(keepends=True),
+                                        f"{title} (revision {number - 1})", f"{title} (revision {number})"))
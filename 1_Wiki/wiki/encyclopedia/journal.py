@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+
+from django.core.files.storage import default_storage
+
+
+class JournaledIndex:
+    """
+    Index of the encyclopedia entries stored on disk as a snapshot plus a journal
+    of the entries saved since: it is loaded on first lookup, and saving an entry
+    only appends a line to the journal. Journal lines written by other processes
+    are replayed before each lookup.
+
+    Subclasses hold the indexed data and define:
+    - `_reset()`, emptying the index,
+    - `_snapshot()` and `_restore(snapshot)`, the JSON payload of the snapshot,
+    - `_apply(change)`, applying a journal line,
+    - `_sync(titles)`, indexing entries added and dropping entries removed without save_entry.
+    """
+
+    # name of the snapshot file in the index directory
+    snapshot_name = "index.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._loaded = False
+        # journal bytes already applied and snapshot version they apply to
+        self._journal_offset = 0
+        self._snapshot_mtime = None
+        # titles tuple of the title index the entries were last checked against
+        self._synced_titles = None
+        self._reset()
+
+    @property
+    def snapshot_path(self):
+        return default_storage.path(f"{self.directory}/{self.snapshot_name}")
+
+    @property
+    def journal_path(self):
+        return default_storage.path(f"{self.directory}/journal.jsonl")
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _snapshot(self):
+        raise NotImplementedError
+
+    def _restore(self, snapshot):
+        raise NotImplementedError
+
+    def _apply(self, change):
+        raise NotImplementedError
+
+    def _sync(self, titles):
+        raise NotImplementedError
+
+    def _replay_journal(self):
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(self._journal_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # being written by another process
+                        break
+                    self._apply(json.loads(line))
+                    self._journal_offset += len(line)
+        except FileNotFoundError:
+            pass
+
+    def _load(self):
+        try:
+            snapshot_mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            self.rebuild()
+            return
+        if self._loaded and snapshot_mtime == self._snapshot_mtime:
+            self._replay_journal()
+            return
+        with open(self.snapshot_path) as f:
+            self._restore(json.load(f))
+        self._journal_offset = 0
+        self._snapshot_mtime = snapshot_mtime
+        self._synced_titles = None
+        self._loaded = True
+        self._replay_journal()
+
+    def _current(self):
+        """
+        Brings the index up to date with the journal and the entries.
+        """
+        from . import util
+
+        self._load()
+        self._sync(util.title_index.titles())
+
+    def _append(self, change):
+        """
+        Records a change in the journal.
+        """
+        line = (json.dumps(change) + "\n").encode()
+        with self._lock:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            # a single append is not interleaved with other processes appends
+            with open(self.journal_path, "ab") as f:
+                f.write(line)
+
+    def rebuild(self):
+        """
+        Indexes all entries from scratch and writes a new snapshot.
+        """
+        from . import util
+
+        with self._lock:
+            self._reset()
+            self._synced_titles = None
+            titles = util.title_index.titles()
+            self._sync(titles)
+            util.atomic_write(self.snapshot_path, json.dumps(self._snapshot()).encode())
+            with open(self.journal_path, "w"):
+                pass
+            self._journal_offset = 0
+            self._snapshot_mtime = os.stat(self.snapshot_path).st_mtime_ns
+            self._loaded = True
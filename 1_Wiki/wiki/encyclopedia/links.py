@@ -0,0 +1,130 @@
+import time
+from urllib.parse import unquote
+
+from .journal import JournaledIndex
+from .markdown import inline_elements
+
+# Links to entries are relative to the site root
+ENTRY_PREFIX = "/wiki/"
+
+
+def extract_links(content):
+    """
+    Returns the sorted titles of the entries a Markdown content links to.
+    """
+    links = set()
+    for start, end, kind, text, href in inline_elements(content):
+        if kind == "link" and href.startswith(ENTRY_PREFIX) and len(href) > len(ENTRY_PREFIX):
+            links.add(unquote(href[len(ENTRY_PREFIX):]))
+    return sorted(links)
+
+
+class LinkGraph(JournaledIndex):
+    """
+    Links between entries, as forward (entry -> linked titles) and backward
+    (lowercase title -> entries linking to it) adjacency, so that backlinks are
+    looked up rather than searched for.
+
+    Like the search index, the graph is journaled (see JournaledIndex): links are
+    extracted once, when an entry is saved. `manage.py wiki_link_graph` rebuilds the snapshot.
+    """
+
+    snapshot_name = "graph.json"
+
+    def __init__(self, directory="links"):
+        super().__init__(directory)
+
+    def _reset(self):
+        # title -> sorted titles it links to
+        self.forward = {}
+        # lowercase title -> titles linking to it
+        self.backward = {}
+        # lowercase title -> timestamp of the last change of the titles linking to it
+        self.changed = {}
+
+    def _snapshot(self):
+        return {"forward": self.forward, "changed": self.changed}
+
+    def _restore(self, snapshot):
+        self.forward = {}
+        self.backward = {}
+        for title, links in snapshot["forward"].items():
+            self._set(title, links, None)
+        self.changed = snapshot["changed"]
+
+    def _set(self, title, links, timestamp):
+        """
+        Replaces the links of an entry (None removing the entry).
+        """
+        old_targets = {target.lower() for target in self.forward.pop(title, ())}
+        new_targets = {target.lower() for target in links or ()}
+        for target in old_targets - new_targets:
+            sources = self.backward[target]
+            sources.discard(title)
+            if not sources:
+                del self.backward[target]
+            self.changed[target] = timestamp
+        for target in new_targets - old_targets:
+            self.backward.setdefault(target, set()).add(title)
+            self.changed[target] = timestamp
+        if links is not None:
+            self.forward[title] = links
+
+    def _apply(self, change):
+        self._set(change["title"], change["links"], change["date"])
+
+    def _sync(self, titles):
+        """
+        Adds the links of entries added and drops entries removed without save_entry.
+        """
+        if titles is self._synced_titles:
+            return
+        from . import util
+
+        now = time.time()
+        current = set(titles)
+        for title in set(self.forward) - current:
+            self._set(title, None, now)
+        for title in current - set(self.forward):
+            content = util.get_entry(title)
+            if content is not None:
+                self._set(title, extract_links(content), now)
+        self._synced_titles = titles
+
+    def update(self, title, content):
+        """
+        Records the links of an entry content (None meaning a missing entry).
+        """
+        self._append({
+            "title": title,
+            "links": extract_links(content) if content is not None else None,
+            "date": time.time(),
+        })
+
+    def backlinks(self, title):
+        """
+        Returns the sorted titles of the other entries linking to an entry.
+        """
+        with self._lock:
+            self._current()
+            return sorted(self.backward.get(title.lower(), set()) - {title})
+
+    def backlinks_changed(self, title):
+        """
+        Returns the timestamp of the last change of the entries linking
+        to an entry, or None if it never changed.
+        """
+        with self._lock:
+            self._current()
+            return self.changed.get(title.lower())
+
+    def orphans(self):
+        """
+        Returns the sorted titles of the entries no other entry links to.
+        """
+        with self._lock:
+            self._current()
+            return [title for title in sorted(self.forward) if not self.backward.get(title.lower(), set()) - {title}]
+
+
+link_graph = LinkGraph()
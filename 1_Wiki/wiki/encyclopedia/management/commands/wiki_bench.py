@@ -0,0 +1,498 @@
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import wsgiref.util
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import clear_url_caches
+
+from encyclopedia import urls, util
+from encyclopedia.fuzzy import TrigramIndex
+from encyclopedia.storage import FileEntryStorage, get_entry_storage
+
+BENCHMARKS = ["markdown", "fuzz", "fuzzy", "wiki", "storage", "load"]
+
+STORAGES = {
+    "file": "encyclopedia.storage.FileEntryStorage",
+    "pack": "encyclopedia.pack.PackEntryStorage",
+    "sqlite": "encyclopedia.sqlite.SQLiteEntryStorage",
+}
+
+SIZES = {
+    "1KB": 1024,
+    "100KB": 100 * 1024,
+    "5MB": 5 * 1024 * 1024,
+}
+
+
+def legacy_markdown_to_html(content):
+    """
+    Original regex cascade renderer, kept as the reference the benchmark compares against.
+    """
+    for i in range(1, 7):
+        pattern = '(^|\n)#{' + str(i) + '} (.+)\n'
+        repl = '\\1<h' + str(i) + '>\\2</h' + str(i) + '>\n'
+        content = re.sub(pattern, repl, content)
+    content = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', content)
+    content = re.sub(r'\*([^ ][^*]+)\*', r'<em>\1</em>', content)
+    content = re.sub(r'`([^`]+)`', r'<code>\1</code>', content)
+    content = re.sub(r'\n(([-|*] .*\n)+)\n', r'\n<ul>\n\1</ul>\n\n', content)
+    content = re.sub(r'\n[-|*] (.*)', r'\n<li>\1</li>', content)
+    content = re.sub(r'\n((\d+\. .*\n)+)\n', r'\n<ol>\n\1</ol>\n', content)
+    content = re.sub(r'\n\d+\. (.*)', r'\n<li>\1</li>', content)
+    content = re.sub(r'\[([^]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', content)
+    content = re.sub(r'^\s(.+)\s$', r'\n<p>\1</p>\n', content, flags=re.MULTILINE)
+    return content
+
+
+def generate_entry(size, seed=0):
+    """
+    Returns a synthetic Markdown entry of about `size` characters, mixing headings,
+    paragraphs with inline elements and lists.
+    """
+    rng = random.Random(seed)
+    words = ["wiki", "page", "entry", "**bold text**", "*italic text*", "`code`",
+             "[Python](/wiki/Python)", "markdown", "encyclopedia", "django"]
+    blocks = []
+    length = 0
+    while length < size:
+        choice = rng.random()
+        if choice < 0.1:
+            block = "#" * rng.randint(1, 6) + " " + " ".join(rng.choices(words, k=3))
+        elif choice < 0.3:
+            marker = rng.choice(["*", "-", "1."])
+            block = "\n".join(f"{marker} " + " ".join(rng.choices(words, k=4)) for _ in range(rng.randint(2, 6)))
+        else:
+            block = " ".join(rng.choices(words, k=rng.randint(10, 40)))
+        blocks.append(block)
+        length += len(block) + 2
+    return "\n\n".join(blocks) + "\n"
+
+
+def pathological_entries(size, seed=0):
+    """
+    Returns Markdown documents of about `size` characters crafted to make a
+    backtracking renderer take a time quadratic in their size, by name.
+    """
+    rng = random.Random(seed)
+
+    def repeat(pattern):
+        return pattern * (size // len(pattern))
+
+    return {
+        "unclosed brackets": repeat("["),
+        "unclosed links": repeat("[a](x"),
+        "nested links": repeat("[") + "a](b)" + repeat(")"),
+        "unclosed emphasis": repeat("*a"),
+        "unclosed strong": repeat("**a"),
+        "unclosed code": repeat("`a"),
+        "unclosed list": "\n" + repeat("- [a\n"),
+        "long heading": "# " + repeat("[*"),
+        "blank lines": repeat("\n \n"),
+        "random": "".join(rng.choices("*`[]()#-1. \na", k=size)),
+    }
+
+
+def generate_titles(count, seed=0):
+    """
+    Returns `count` distinct synthetic titles made of one to three pseudo-words.
+    """
+    rng = random.Random(seed)
+    syllables = [consonant + vowel for consonant in "bcdfghjklmnprstvwz" for vowel in "aeiouy"]
+    titles = set()
+    while len(titles) < count:
+        words = ("".join(rng.choices(syllables, k=rng.randint(2, 5))).capitalize()
+                 for _ in range(rng.randint(1, 3)))
+        titles.add(" ".join(words))
+    return sorted(titles)
+
+
+def misspell(title, rng):
+    """
+    Returns the title with one character replaced.
+    """
+    i = rng.randrange(len(title))
+    return title[:i] + rng.choice("aeiouxyz") + title[i + 1:]
+
+
+class SlowFileEntryStorage(FileEntryStorage):
+    """
+    File storage taking `delay` seconds more to read an entry, as a slow disk would.
+    """
+    delay = 0
+
+    def read(self, title):
+        time.sleep(self.delay)
+        return super().read(title)
+
+
+def serve_views(async_views):
+    """
+    Routes the encyclopedia URLs to the sync or async views.
+    """
+    with override_settings(WIKI_ASYNC_VIEWS=async_views):
+        importlib.reload(urls)
+    # the root URLconf holds the resolver of the encyclopedia URLs
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+def wsgi_get(handler, path):
+    """
+    Requests a page from a WSGI application, as a WSGI server would. Returns the response status code.
+    """
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "SERVER_NAME": "testserver"}
+    wsgiref.util.setup_testing_defaults(environ)
+    status = []
+    response = handler(environ, lambda response_status, headers: status.append(int(response_status.split()[0])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0]
+
+
+async def asgi_get(application, path):
+    """
+    Requests a page from an ASGI application, as an ASGI server would. Returns the response status code.
+    """
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": [],
+             "server": ("testserver", 80)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]["status"]
+
+
+def timeit(function, *args, repeat=3):
+    """
+    Returns the best wall clock time of `repeat` calls, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the encyclopedia hot paths on synthetic data. Timings are in milliseconds; "
+            "the command fails if one of them regresses past the baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument("benchmarks", nargs="*", choices=BENCHMARKS,
+                            help="Benchmarks to run (all by default)")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per measure (best is kept)")
+        parser.add_argument("--entries", type=int, default=1000, help="Number of entries of the wiki corpus")
+        parser.add_argument("--entry-size", type=int, default=4096, help="Size of the wiki corpus entries")
+        parser.add_argument("--storage-counts", type=int, nargs="+", default=[1000, 10000, 100000],
+                            help="Numbers of entries the entry storages are compared at")
+        parser.add_argument("--storage-entry-size", type=int, default=512,
+                            help="Size of the entries of the storage comparison")
+        parser.add_argument("--fuzz-size", type=int, default=16,
+                            help="Size in KB of the pathological entries (also rendered at 4 times this size)")
+        parser.add_argument("--budget", type=float, default=2.0,
+                            help="Allowed rendering time of pathological entries, in milliseconds per KB")
+        parser.add_argument("--clients", type=int, default=200, help="Concurrent clients of the load test")
+        parser.add_argument("--client-requests", type=int, default=5,
+                            help="Number of entry pages requested by each client of the load test")
+        parser.add_argument("--read-delay", type=float, default=5.0,
+                            help="Time added to each entry read by the load test, in milliseconds")
+        parser.add_argument("--wsgi-threads", type=int,
+                            help="Threads of the WSGI worker of the load test (WIKI_ASYNC_THREADS by default, "
+                                 "as many as the async views run on)")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+        parser.add_argument("--json", help="File to write the results to")
+        parser.add_argument("--baseline", help="Results file (see --json) to compare with")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed slowdown over the baseline (0.25 for 25%%)")
+
+    def handle(self, *args, **options):
+        results = {}
+        for benchmark in options["benchmarks"] or BENCHMARKS:
+            results.update(getattr(self, f"bench_{benchmark}")(options))
+
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump({
+                    "options": {option: options[option] for option in ["repeat", "entries", "entry_size", "storage_counts",
+                                                                       "storage_entry_size", "fuzz_size", "clients",
+                                                                       "client_requests", "read_delay",
+                                                                       "wsgi_threads", "seed"]},
+                    "results": results
+                }, f, indent=4)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["results"]
+            regressions = [f"{name}: {results[name]:.3f} ms (baseline {baseline[name]:.3f} ms)"
+                           for name in results
+                           if name in baseline and results[name] > baseline[name] * (1 + options["tolerance"])]
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+            self.stdout.write("No regression over the baseline")
+
+    def report(self, name, milliseconds, note=""):
+        self.stdout.write(f"{name:>24}: {milliseconds:10.3f} ms {note}".rstrip())
+
+    def bench_markdown(self, options):
+        """
+        Compares the Markdown renderer with the original regex renderer, and
+        times rendering an entry again after a one-line edit.
+        """
+        results = {}
+        for label, size in SIZES.items():
+            content = generate_entry(size, options["seed"])
+            legacy = timeit(legacy_markdown_to_html, content, repeat=options["repeat"]) * 1000
+            current = timeit(util.markdown_to_html, content, repeat=options["repeat"]) * 1000
+            self.report(f"markdown_to_html {label}", current, f"(legacy {legacy:.3f} ms, {legacy / current:.1f}x)")
+            results[f"markdown_to_html_{label}"] = current
+
+            # the rendered entries cache misses each edit, the rendered blocks cache holds the other blocks
+            lines = content.split("\n")
+            middle = len(lines) // 2
+            edits = ["\n".join(lines[:middle] + [f"{lines[middle]} edit {i}"] + lines[middle + 1:])
+                     for i in range(options["repeat"])]
+            util.block_cache.clear()
+            util.cached_render_entry(content)
+            edited = timeit(lambda: util.cached_render_entry(edits.pop()), repeat=options["repeat"]) * 1000
+            self.report(f"edited markdown {label}", edited, f"({current / edited:.1f}x faster than rendering it all)")
+            results[f"edited_markdown_{label}"] = edited
+        return results
+
+    def bench_fuzz(self, options):
+        """
+        Renders pathological entries at two sizes, failing if any takes more than the
+        time budget per KB: rendering time must stay linear in the size of entries.
+        """
+        results = {}
+        over_budget = []
+        for size in [options["fuzz_size"] * 1024, options["fuzz_size"] * 4 * 1024]:
+            for name, content in pathological_entries(size, options["seed"]).items():
+                per_kb = timeit(util.markdown_to_html, content, repeat=options["repeat"]) * 1000 / (len(content) / 1024)
+                self.report(f"{name} {len(content) // 1024}KB", per_kb, "per KB")
+                results[f"fuzz_{name.replace(' ', '_')}"] = per_kb
+                if per_kb > options["budget"]:
+                    over_budget.append(f"{name} ({len(content) // 1024}KB): {per_kb:.3f} ms per KB")
+        if over_budget:
+            raise CommandError(f"Rendering over the {options['budget']} ms per KB budget:\n" + "\n".join(over_budget))
+        return results
+
+    def bench_fuzzy(self, options, count=100000, queries=100):
+        """
+        Compares fuzzy title search on the trigram index with a linear substring scan.
+        """
+        titles = generate_titles(count, options["seed"])
+        index = TrigramIndex()
+        start = time.perf_counter()
+        index.sync(tuple(titles))
+        self.stdout.write(f"trigram index of {count} titles built in {time.perf_counter() - start:.2f} s")
+
+        rng = random.Random(options["seed"])
+        typos = [misspell(rng.choice(titles), rng) for _ in range(queries)]
+
+        def scan():
+            for query in typos:
+                [title for title in titles if query.lower() in title.lower()]
+
+        def fuzzy():
+            for query in typos:
+                index.search(query)
+
+        linear = timeit(scan, repeat=options["repeat"]) / queries * 1000
+        trigram = timeit(fuzzy, repeat=options["repeat"]) / queries * 1000
+        found = sum(1 for query in typos if index.search(query)) / queries
+        self.report("trigram search", trigram, f"(substring scan {linear:.3f} ms, "
+                                               f"{found:.0%} of misspelled titles get suggestions)")
+        return {"trigram_search": trigram}
+
+    def bench_wiki(self, options, sample_size=50):
+        """
+        Times storage helpers and views on a synthetic corpus, views being
+        requested through the Django test client.
+        """
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=["testserver"]):
+                rng = random.Random(options["seed"])
+                titles = generate_titles(options["entries"], options["seed"])
+                os.makedirs(os.path.join(media_root, "entries"))
+                # written by the configured entry storage, without history nor indexing
+                storage = get_entry_storage()
+                for i, title in enumerate(titles):
+                    storage.write(title, generate_entry(options["entry_size"], options["seed"] + i))
+                self.stdout.write(f"corpus of {len(titles)} entries of {options['entry_size']} bytes")
+                caches["wiki"].clear()
+                client = Client()
+                sample = rng.sample(titles, min(sample_size, len(titles)))
+                contents = [util.get_entry(title) for title in sample]
+                queries = [title.split()[0] for title in sample]
+                # build the indexes before timing
+                util.list_entries()
+                client.post("/", {"q": queries[0]})
+
+                def each(function, items):
+                    return lambda: [function(item) for item in items]
+
+                results = {
+                    "markdown_to_html": timeit(each(util.markdown_to_html, contents), repeat=options["repeat"]),
+                    "list_entries": timeit(each(lambda title: util.list_entries(), sample), repeat=options["repeat"]),
+                    "get_entry": timeit(each(util.get_entry, sample), repeat=options["repeat"]),
+                    "entry_view": timeit(each(lambda title: client.get(f"/wiki/{title}"), sample),
+                                         repeat=options["repeat"]),
+                    "search_view": timeit(each(lambda query: client.post("/", {"q": query}), queries),
+                                          repeat=options["repeat"]),
+                    "random_view": timeit(each(lambda title: client.get("/random"), sample),
+                                          repeat=options["repeat"]),
+                }
+
+                # typeahead latency: every prefix of the sampled titles
+                latencies = []
+                for title in sample:
+                    for i in range(1, len(title) + 1):
+                        start = time.perf_counter()
+                        client.get("/api/suggest", {"q": title[:i]})
+                        latencies.append(time.perf_counter() - start)
+                latencies.sort()
+        finally:
+            shutil.rmtree(media_root)
+        for name in results:
+            results[name] = results[name] / len(sample) * 1000
+            self.report(name, results[name])
+        for percentile in [50, 99]:
+            name = f"suggest_view_p{percentile}"
+            results[name] = latencies[len(latencies) * percentile // 100] * 1000
+            self.report(name, results[name])
+        return results
+
+    def bench_storage(self, options, sample_size=50):
+        """
+        Compares the entry storages on corpora of increasing sizes: listing titles
+        (title index rebuilt), reading entries, searching and picking a random entry.
+        """
+        results = {}
+        for count in options["storage_counts"]:
+            titles = generate_titles(count, options["seed"])
+            rng = random.Random(options["seed"])
+            sample = rng.sample(titles, min(sample_size, len(titles)))
+            queries = [title.split()[0] for title in sample]
+            contents = [generate_entry(options["storage_entry_size"], options["seed"] + i) for i in range(100)]
+            for name, storage in STORAGES.items():
+                media_root = tempfile.mkdtemp()
+                try:
+                    with override_settings(MEDIA_ROOT=media_root, WIKI_ENTRY_STORAGE=storage):
+                        start = time.perf_counter()
+                        get_entry_storage().write_many((title, contents[i % len(contents)])
+                                                       for i, title in enumerate(titles))
+                        # build the indexes
+                        util.search_entries(queries[0])
+                        self.stdout.write(f"{count} entries stored and indexed by the {name} storage "
+                                          f"in {time.perf_counter() - start:.2f} s")
+
+                        def list_entries():
+                            util.title_index.invalidate()
+                            util.list_entries()
+
+                        measures = {
+                            "list_entries": timeit(list_entries, repeat=options["repeat"]),
+                            "get_entry": timeit(lambda: [util.get_entry(title) for title in sample],
+                                                repeat=options["repeat"]) / len(sample),
+                            "search_entries": timeit(lambda: [util.search_entries(query) for query in queries],
+                                                     repeat=options["repeat"]) / len(queries),
+                            "random_entry": timeit(lambda: [util.random_entry() for title in sample],
+                                                   repeat=options["repeat"]) / len(sample),
+                        }
+                finally:
+                    shutil.rmtree(media_root)
+                for measure, seconds in measures.items():
+                    results[f"{measure}_{name}_{count}"] = seconds * 1000
+                    self.report(f"{measure} {name} {count}", seconds * 1000)
+        return results
+
+    def bench_load(self, options):
+        """
+        Compares the throughput of a single worker serving entry pages to many concurrent
+        clients while entries are read from a slow disk: a WSGI worker with a few threads,
+        and an ASGI worker serving the sync views or the async ones.
+        Timings are the wall clock time per request served.
+        """
+        wsgi_threads = options["wsgi_threads"] or settings.WIKI_ASYNC_THREADS
+        media_root = tempfile.mkdtemp()
+        storage = "encyclopedia.management.commands.wiki_bench.SlowFileEntryStorage"
+        try:
+            with override_settings(MEDIA_ROOT=media_root, ALLOWED_HOSTS=["testserver"], WIKI_ENTRY_STORAGE=storage):
+                titles = generate_titles(options["entries"], options["seed"])
+                os.makedirs(os.path.join(media_root, "entries"))
+                get_entry_storage().write_many((title, generate_entry(options["entry_size"], options["seed"] + i))
+                                               for i, title in enumerate(titles))
+                caches["wiki"].clear()
+                rng = random.Random(options["seed"])
+                paths = [[f"/wiki/{rng.choice(titles)}" for _ in range(options["client_requests"])]
+                         for _ in range(options["clients"])]
+                requests = sum(len(client_paths) for client_paths in paths)
+                # render the pages before timing: the load test measures reads
+                for title in titles:
+                    wsgi_get(WSGIHandler(), f"/wiki/{title}")
+                SlowFileEntryStorage.delay = options["read_delay"] / 1000
+
+                def wsgi():
+                    # the worker threads take the requests of all clients in turn
+                    handler = WSGIHandler()
+                    with ThreadPoolExecutor(max_workers=wsgi_threads) as worker:
+                        statuses = list(worker.map(lambda path: wsgi_get(handler, path),
+                                                   [path for client_paths in paths for path in client_paths]))
+                    assert statuses == [200] * requests
+
+                async def clients():
+                    handler = ASGIHandler()
+
+                    async def client(client_paths):
+                        for path in client_paths:
+                            assert await asgi_get(handler, path) == 200
+
+                    await asyncio.gather(*(client(client_paths) for client_paths in paths))
+
+                def asgi(async_views):
+                    serve_views(async_views)
+                    try:
+                        asyncio.run(clients())
+                    finally:
+                        serve_views(settings.WIKI_ASYNC_VIEWS)
+
+                results = {
+                    "load_wsgi": timeit(wsgi, repeat=options["repeat"]),
+                    "load_asgi_sync_views": timeit(asgi, False, repeat=options["repeat"]),
+                    "load_asgi_async_views": timeit(asgi, True, repeat=options["repeat"]),
+                }
+        finally:
+            SlowFileEntryStorage.delay = 0
+            shutil.rmtree(media_root)
+        self.stdout.write(f"{options['clients']} clients, {requests} requests, "
+                          f"{options['read_delay']} ms per entry read, {wsgi_threads} WSGI threads, "
+                          f"{settings.WIKI_ASYNC_THREADS} async view threads")
+        for name in results:
+            seconds = results[name]
+            results[name] = seconds / requests * 1000
+            self.report(name, results[name], f"({requests / seconds:.0f} requests/s)")
+        return results
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+
+from encyclopedia import markdown, util
+from encyclopedia.views import table_of_contents
+
+MANIFEST = ".manifest.json"
+
+# Static pages have no CSRF token: Django's csrf_token tag then renders nothing
+# (searching from the sidebar needs none)
+NO_CSRF_TOKEN = "NOTPROVIDED"
+
+
+def init_worker(settings_module):
+    # needed when worker processes are spawned rather than forked
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    django.setup()
+
+
+def build_entry(args):
+    """
+    Renders the page of an entry to <output>/wiki/<title>.html.
+    """
+    output, title, content, backlinks = args
+    headings = []
+    html = markdown.render(content, headings=headings)
+    page = render_to_string("encyclopedia/entry.html", {
+        "title": title,
+        "content": html,
+        "toc": table_of_contents(headings),
+        "backlinks": backlinks,
+        "csrf_token": NO_CSRF_TOKEN
+    })
+    util.atomic_write(os.path.join(output, "wiki", f"{title}.html"), page.encode())
+    return title
+
+
+class Command(BaseCommand):
+    help = ("Renders all encyclopedia pages to static HTML files (index.html and wiki/<title>.html), "
+            "rendering again only the entries changed since the last build")
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Output directory")
+        parser.add_argument("--force", action="store_true", help="Render all entries (e.g. after a template change)")
+        parser.add_argument("--workers", type=int, default=None, help="Processes rendering entries")
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        start = time.perf_counter()
+        manifest_path = os.path.join(output, MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = {} if options["force"] else json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+
+        titles = util.list_entries()
+        hashes = {}
+        changed = []
+        for title in titles:
+            content = util.get_entry(title)
+            if content is None:
+                continue
+            # pages also change when their backlinks do
+            backlinks = util.entry_backlinks(title)
+            hashes[title] = hashlib.sha256("\0".join([content] + backlinks).encode()).hexdigest()
+            if manifest.get(title) != hashes[title]:
+                changed.append((output, title, content, backlinks))
+
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker,
+                                 initargs=(settings.SETTINGS_MODULE,)) as pool:
+            for title in pool.map(build_entry, changed, chunksize=16):
+                manifest[title] = hashes[title]
+
+        removed = set(manifest) - set(hashes)
+        for title in removed:
+            del manifest[title]
+            try:
+                os.remove(os.path.join(output, "wiki", f"{title}.html"))
+            except FileNotFoundError:
+                pass
+
+        if changed or removed or not os.path.exists(os.path.join(output, "index.html")):
+            page = render_to_string("encyclopedia/index.html", {
+                "query": False,
+                "entries": list(hashes),
+                "csrf_token": NO_CSRF_TOKEN
+            })
+            util.atomic_write(os.path.join(output, "index.html"), page.encode())
+        util.atomic_write(manifest_path, json.dumps(manifest).encode())
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Rendered {len(changed)} of {len(hashes)} entries ({len(removed)} removed) "
+                          f"in {elapsed:.2f} s")
@@ -0,0 +1,57 @@
+import io
+import os
+import tarfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia import util
+
+TARBALL_MODES = {
+    ".tar": "w",
+    ".tar.gz": "w:gz",
+    ".tgz": "w:gz",
+    ".tar.bz2": "w:bz2",
+    ".tar.xz": "w:xz",
+}
+
+
+def entries():
+    """
+    Yields (title, content) pairs of all entries, one at a time.
+    """
+    for title in util.list_entries():
+        content = util.get_entry(title)
+        if content is not None:
+            yield title, content
+
+
+class Command(BaseCommand):
+    help = "Exports encyclopedia entries to a directory or a tarball of Markdown files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("destination",
+                            help="Directory, or tarball if ending with .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz")
+
+    def handle(self, *args, **options):
+        destination = options["destination"]
+        mode = next((mode for extension, mode in TARBALL_MODES.items() if destination.endswith(extension)), None)
+
+        exported = 0
+        start = time.perf_counter()
+        if mode:
+            with tarfile.open(destination, mode) as tar:
+                for title, content in entries():
+                    data = content.encode()
+                    info = tarfile.TarInfo(f"{title}.md")
+                    info.size = len(data)
+                    info.mtime = time.time()
+                    tar.addfile(info, io.BytesIO(data))
+                    exported += 1
+        else:
+            os.makedirs(destination, exist_ok=True)
+            for title, content in entries():
+                util.atomic_write(os.path.join(destination, f"{title}.md"), content.encode())
+                exported += 1
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Exported {exported} entries in {elapsed:.2f} s ({exported / elapsed:.0f} entries/s)")
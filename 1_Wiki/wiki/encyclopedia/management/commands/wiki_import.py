@@ -0,0 +1,87 @@
+import itertools
+import os
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+
+
+def read_directory(path):
+    """
+    Yields (title, bytes) pairs of the Markdown files of a directory.
+    """
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith(".md"):
+            with open(os.path.join(path, filename), "rb") as f:
+                yield filename[:-3], f.read()
+
+
+def read_tarball(path):
+    """
+    Yields (title, bytes) pairs of the Markdown files of a (compressed) tarball,
+    reading its members one at a time.
+    """
+    with tarfile.open(path) as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith(".md"):
+                yield os.path.basename(member.name)[:-3], tar.extractfile(member).read()
+
+
+def prepare(item):
+    """
+    Validates and decodes an entry. Returns (title, content, error).
+    """
+    title, data = item
+    if not util.valid_title(title):
+        return title, None, "invalid title"
+    try:
+        content = data.decode("utf-8").replace("\r\n", "\n")
+    except UnicodeDecodeError:
+        return title, None, "content is not UTF-8"
+    return title, content, None
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+class Command(BaseCommand):
+    help = "Imports encyclopedia entries from a directory or a tarball of Markdown files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Directory or tarball (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz)")
+        parser.add_argument("--batch-size", type=int, default=500, help="Entries saved at once")
+        parser.add_argument("--workers", type=int, default=None, help="Processes validating entries")
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        if os.path.isdir(source):
+            entries = read_directory(source)
+        elif tarfile.is_tarfile(source):
+            entries = read_tarball(source)
+        else:
+            raise CommandError(f"{source} is neither a directory nor a tarball")
+
+        imported = skipped = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            for batch in batches(entries, options["batch_size"]):
+                valid = []
+                for title, content, error in pool.map(prepare, batch, chunksize=16):
+                    if error:
+                        self.stderr.write(f"Skipping {title}: {error}")
+                        skipped += 1
+                    else:
+                        valid.append((title, content))
+                util.save_entries(valid)
+                imported += len(valid)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Imported {imported} entries ({skipped} skipped) in {elapsed:.2f} s "
+                          f"({imported / elapsed:.0f} entries/s)")
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia.links import link_graph
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the graph of the links between encyclopedia entries"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        link_graph.rebuild()
+        self.stdout.write(f"Indexed the links of {len(link_graph.forward)} entries "
+                          f"({sum(map(len, link_graph.forward.values()))} links) "
+                          f"in {time.perf_counter() - start:.2f} s")
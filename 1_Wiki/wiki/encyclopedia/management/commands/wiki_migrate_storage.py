@@ -0,0 +1,38 @@
+import itertools
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+
+class Command(BaseCommand):
+    help = ("Copies the encyclopedia entries from an entry storage to another, e.g. from the entries folder "
+            "to a SQLite database: wiki_migrate_storage encyclopedia.sqlite.SQLiteEntryStorage")
+
+    def add_arguments(self, parser):
+        parser.add_argument("destination", help="Class path of the entry storage to copy entries to")
+        parser.add_argument("--source", default="encyclopedia.storage.FileEntryStorage",
+                            help="Class path of the entry storage to copy entries from (the entries folder by default)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Entries written at once")
+
+    def handle(self, *args, **options):
+        try:
+            source = import_string(options["source"])()
+            destination = import_string(options["destination"])()
+        except ImportError as e:
+            raise CommandError(e)
+
+        start = time.perf_counter()
+        titles = source.titles()
+        entries = ((title, source.read(title)) for title in titles)
+        migrated = 0
+        while True:
+            batch = list(itertools.islice(entries, options["batch_size"]))
+            if not batch:
+                break
+            # skip entries removed since listed
+            batch = [(title, content) for title, content in batch if content is not None]
+            destination.write_many(batch)
+            migrated += len(batch)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Migrated {migrated} entries in {elapsed:.2f} s")
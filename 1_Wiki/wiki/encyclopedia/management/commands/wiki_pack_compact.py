@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia.pack import PackEntryStorage
+from encyclopedia.storage import get_entry_storage
+
+
+class Command(BaseCommand):
+    help = "Rewrites the entries pack file without the replaced entry contents"
+
+    def handle(self, *args, **options):
+        storage = get_entry_storage()
+        if not isinstance(storage, PackEntryStorage):
+            raise CommandError("Entries are not stored in a pack file (see the WIKI_ENTRY_STORAGE setting)")
+        start = time.perf_counter()
+        reclaimed = storage.compact()
+        self.stdout.write(f"Compacted {len(storage.titles())} entries, reclaiming {reclaimed} bytes "
+                          f"in {time.perf_counter() - start:.2f} s")
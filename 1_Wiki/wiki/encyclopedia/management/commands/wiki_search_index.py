@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia.search import search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of the encyclopedia entries"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        search_index.rebuild()
+        self.stdout.write(f"Indexed {len(search_index.lengths)} entries "
+                          f"({len(search_index.postings)} terms) in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,263 @@
+import re
+import time
+from collections import namedtuple
+
+from django.utils.text import slugify
+
+# A top-level block of a Markdown document.
+# kind: "blank", "heading", "ul", "ol" or "paragraph"
+# lines: raw source lines (without line breaks) the block is made of
+# wrap: whether the block is wrapped into a <p> element
+Block = namedtuple("Block", ["kind", "lines", "wrap"])
+
+# A heading of a Markdown document, for its table of contents.
+# level: 1 to 6
+# text: heading text, without markup
+# anchor: id of the heading element, unique in the document
+Heading = namedtuple("Heading", ["level", "text", "anchor"])
+
+HEADING = re.compile(r"(#{1,6}) (.+)")
+UL_ITEM = re.compile(r"[-*] (.*)")
+OL_ITEM = re.compile(r"\d+\. (.*)")
+
+# Characters inline elements start with
+INLINE_START = re.compile(r"[*`\[]")
+
+
+class RenderTimeout(Exception):
+    """
+    Raised when rendering a document takes longer than allowed.
+    """
+
+
+def _classify(line):
+    """
+    Returns the kind of block a source line belongs to.
+    """
+    first = line[:1]
+    if not line.strip():
+        return "blank"
+    if first == "#" and HEADING.match(line):
+        return "heading"
+    if first in "-*" and UL_ITEM.match(line):
+        return "ul"
+    if first.isdigit() and OL_ITEM.match(line):
+        return "ol"
+    return "paragraph"
+
+
+def tokenize(lines):
+    """
+    Splits an iterable of source lines into top-level blocks, in a single pass.
+
+    Lines are given without their line break, the way str.split("\\n") returns
+    them: a document ending with a line break has an empty last line.
+    A block is wrapped into a paragraph when it sits between a blank line and
+    a line break followed by another blank line, the way the original regex
+    renderer did, so that existing entries render identically.
+    """
+    kind = None
+    block = []
+    after_blank = False
+    for line in lines:
+        line_kind = _classify(line)
+        if kind is not None:
+            if line_kind == kind and kind in ("paragraph", "ul", "ol"):
+                block.append(line)
+                continue
+            yield Block(kind, tuple(block), after_blank and line_kind == "blank")
+            after_blank = kind == "blank"
+        kind = line_kind
+        block = [line]
+    if kind is not None:
+        yield Block(kind, tuple(block), False)
+
+
+class _Finder:
+    """
+    Finds the next occurrence of characters in a text, remembering the last
+    occurrence found of each: as lookups move forward in the text, each part
+    of it is searched at most once per character.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        # character -> (position searched from, position found or -1)
+        self._found = {}
+
+    def find(self, char, start):
+        searched, found = self._found.get(char, (None, None))
+        if searched is None or not searched <= start or (found != -1 and found < start):
+            found = self.text.find(char, start)
+            self._found[char] = (start, found)
+        return found
+
+
+def inline_elements(text):
+    """
+    Yields the inline elements of a piece of text as (start, end, kind, value, href)
+    tuples, kind being "strong", "em", "code" or "link".
+
+    Elements are matched the way the regular expression
+    \*\*([^*]+)\*\*|\*([^ *][^*]+)\*|`([^`]+)`|\[([^]]+)\]\(([^)]+)\)
+    would match them, leftmost first, but in linear time: the expression backtracks
+    over the whole text from each unclosed bracket.
+    """
+    finder = _Finder(text)
+    length = len(text)
+    match = INLINE_START.search(text)
+    while match:
+        i = match.start()
+        char = text[i]
+        element = None
+        if char == "*":
+            if text.startswith("**", i) and i + 2 < length:
+                end = finder.find("*", i + 2)
+                if end > i + 2 and text.startswith("**", end):
+                    element = (i, end + 2, "strong", text[i + 2:end], None)
+            if element is None and i + 1 < length and text[i + 1] not in " *":
+                end = finder.find("*", i + 2)
+                if end > i + 2:
+                    element = (i, end + 1, "em", text[i + 1:end], None)
+        elif char == "`":
+            end = finder.find("`", i + 1)
+            if end > i + 1:
+                element = (i, end + 1, "code", text[i + 1:end], None)
+        else:
+            end = finder.find("]", i + 1)
+            if end > i + 1 and text.startswith("(", end + 1):
+                href_end = finder.find(")", end + 2)
+                if href_end > end + 2:
+                    element = (i, href_end + 1, "link", text[i + 1:end], text[end + 2:href_end])
+        if element is not None:
+            yield element
+            match = INLINE_START.search(text, element[1])
+        else:
+            match = INLINE_START.search(text, i + 1)
+
+
+def render_inline(text):
+    """
+    Renders bold, italic, code and link elements of a piece of text.
+    """
+    if "*" not in text and "`" not in text and "[" not in text:
+        return text
+    html = []
+    position = 0
+    for start, end, kind, value, href in inline_elements(text):
+        html.append(text[position:start])
+        if kind == "link":
+            html.append(f'<a href="{href}">{render_inline(value)}</a>')
+        else:
+            html.append(f"<{kind}>{value}</{kind}>")
+        position = end
+    html.append(text[position:])
+    return "".join(html)
+
+
+def inline_text(text):
+    """
+    Returns a piece of text without the markup of its inline elements.
+    """
+    if "*" not in text and "`" not in text and "[" not in text:
+        return text
+    parts = []
+    position = 0
+    for start, end, kind, value, href in inline_elements(text):
+        parts.append(text[position:start])
+        parts.append(inline_text(value) if kind == "link" else value)
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def render_block(block):
+    """
+    Returns the HTML of a single block.
+    """
+    kind, lines, wrap = block
+    if kind == "blank":
+        return lines[0]
+    if kind in ("ul", "ol"):
+        item = UL_ITEM if kind == "ul" else OL_ITEM
+        items = "\n".join(f"<li>{render_inline(item.match(line).group(1))}</li>" for line in lines)
+        return f"<{kind}>\n{items}\n</{kind}>"
+    if kind == "heading":
+        hashes, text = HEADING.match(lines[0]).groups()
+        html = f"<h{len(hashes)}>{render_inline(text)}</h{len(hashes)}>"
+    else:
+        html = render_inline("\n".join(lines))
+    return f"<p>{html}</p>" if wrap else html
+
+
+def _render_blocks(blocks, render_block, headings):
+    """
+    Yields the HTML of blocks. If headings is a list, heading elements get an
+    id anchor and the headings are appended to the list as they are rendered.
+    """
+    if headings is None:
+        for block in blocks:
+            yield render_block(block)
+        return
+    anchors = set()
+    for block in blocks:
+        if block.kind != "heading":
+            yield render_block(block)
+            continue
+        hashes, text = HEADING.match(block.lines[0]).groups()
+        plain_text = inline_text(text)
+        # anchors only depend on the heading text, numbered when repeated
+        slug = slugify(plain_text, allow_unicode=True) or "section"
+        anchor = slug
+        number = 1
+        while anchor in anchors:
+            number += 1
+            anchor = f"{slug}-{number}"
+        anchors.add(anchor)
+        headings.append(Heading(len(hashes), plain_text, anchor))
+        html = f'<h{len(hashes)} id="{anchor}">{render_inline(text)}</h{len(hashes)}>'
+        yield f"<p>{html}</p>" if block.wrap else html
+
+
+def render(content, render_block=render_block, timeout=None, headings=None):
+    """
+    Converts content string from Markdown to HTML, supporting headings, bold and
+    italic text, code phrases, ordered and unordered lists, links and paragraphs.
+    Blocks are converted by the given render_block function (e.g. a cached one).
+    If headings is a list, the headings are collected in it, in the same pass.
+    Rendering takes a time linear in the size of the content; if it still takes
+    more than timeout seconds, RenderTimeout is raised.
+    """
+    blocks = _render_blocks(tokenize(content.split("\n")), render_block, headings)
+    if timeout is None:
+        return "\n".join(blocks)
+    deadline = time.monotonic() + timeout
+    html = []
+    for block_html in blocks:
+        if time.monotonic() > deadline:
+            raise RenderTimeout()
+        html.append(block_html)
+    return "\n".join(html)
+
+
+def render_chunks(lines, chunk_size=64 * 1024, render_block=render_block, headings=None):
+    """
+    Converts an iterable of source lines from Markdown to HTML block by block,
+    yielding the HTML in chunks of about chunk_size characters, so that a large
+    document never needs to be held in memory. If headings is a list, the
+    headings are collected in it as they are rendered.
+    """
+    chunk = []
+    length = 0
+    separator = ""
+    for block_html in _render_blocks(tokenize(lines), render_block, headings):
+        html = separator + block_html
+        separator = "\n"
+        chunk.append(html)
+        length += len(html)
+        if length >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield "".join(chunk)
@@ -0,0 +1,197 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .storage import atomic_write
+
+# Record header: modification timestamp, title length and content length in bytes.
+# The title and content (UTF-8) follow the header.
+HEADER = struct.Struct("<dII")
+
+
+def _datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def _text(data):
+    # decode the way the entries files are read in text mode
+    text = str(data, "utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+class PackEntryStorage:
+    """
+    Stores all entries in a single append-only pack file, read through mmap.
+
+    Saving an entry appends a record, so the pack keeps the replaced contents until
+    `manage.py wiki_pack_compact` rewrites it. Each process maps the pack and keeps
+    an offset index of the last record of each title, extended with the records
+    other processes append and rebuilt when the pack is compacted.
+    """
+
+    def __init__(self, directory="pack"):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._map = None
+        # (path, inode) of the mapped pack
+        self._file = None
+        self._size = 0
+        # title -> (content offset, content length, modification timestamp)
+        self._index = {}
+        self._titles = None
+        self._modified = 0.0
+
+    @property
+    def path(self):
+        return default_storage.path(f"{self.directory}/entries.pack")
+
+    def _file_lock(self, operation):
+        # serializes appends with compactions of other processes
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path + ".lock", "a")
+        fcntl.flock(f, operation)
+        return f
+
+    def _scan(self, start, end):
+        offset = start
+        while offset + HEADER.size <= end:
+            timestamp, title_length, content_length = HEADER.unpack_from(self._map, offset)
+            content_offset = offset + HEADER.size + title_length
+            if content_offset + content_length > end:
+                # being written by another process
+                break
+            title = str(self._map[offset + HEADER.size:content_offset], "utf-8")
+            if title not in self._index:
+                self._titles = None
+            self._index[title] = (content_offset, content_length, timestamp)
+            self._modified = max(self._modified, timestamp)
+            offset = content_offset + content_length
+        self._size = offset
+
+    def _refresh(self):
+        """
+        Maps the records appended since the last call, remapping the whole pack
+        if it was replaced by a compaction.
+        """
+        path = self.path
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if self._file is not None:
+                self._reset()
+            return
+        if (path, stat.st_ino) != self._file:
+            self._reset()
+            self._file = (path, stat.st_ino)
+        if stat.st_size > self._size:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._scan(self._size, len(self._map))
+
+    def _record(self, title):
+        with self._lock:
+            self._refresh()
+            record = self._index.get(title)
+            return (self._map, record) if record is not None else (None, None)
+
+    def version(self):
+        with self._lock:
+            self._refresh()
+            return self._file, len(self._index)
+
+    def modified_time(self):
+        with self._lock:
+            self._refresh()
+            return _datetime(self._modified)
+
+    def titles(self):
+        with self._lock:
+            self._refresh()
+            if self._titles is None:
+                self._titles = sorted(self._index)
+            return self._titles
+
+    def read(self, title):
+        data, record = self._record(title)
+        if record is None:
+            return None
+        offset, length, _ = record
+        with memoryview(data) as view:
+            return _text(view[offset:offset + length])
+
+    def write(self, title, content):
+        self.write_many([(title, content)])
+
+    def write_many(self, entries):
+        records = []
+        now = time.time()
+        for title, content in entries:
+            encoded_title = title.encode()
+            encoded_content = content.encode()
+            records += [HEADER.pack(now, len(encoded_title), len(encoded_content)), encoded_title, encoded_content]
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, b"".join(records))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def size(self, title):
+        _, record = self._record(title)
+        return record[1] if record is not None else None
+
+    def entry_modified_time(self, title):
+        _, record = self._record(title)
+        return _datetime(record[2]) if record is not None else None
+
+    def iter_lines(self, title):
+        data, record = self._record(title)
+        if record is None:
+            raise FileNotFoundError(title)
+        offset, length, _ = record
+        end = offset + length
+        with memoryview(data) as view:
+            while True:
+                line_end = data.find(b"\n", offset, end)
+                if line_end == -1:
+                    yield str(view[offset:end], "utf-8")
+                    return
+                yield str(view[offset:line_end], "utf-8")
+                offset = line_end + 1
+
+    def compact(self):
+        """
+        Rewrites the pack keeping only the last record of each entry.
+        Returns the number of bytes reclaimed.
+        """
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            self._refresh()
+            if self._map is None:
+                return 0
+            size = self._size
+            with memoryview(self._map) as view:
+                records = []
+                for title in sorted(self._index):
+                    offset, length, timestamp = self._index[title]
+                    encoded_title = title.encode()
+                    records.append(HEADER.pack(timestamp, len(encoded_title), length))
+                    records.append(encoded_title)
+                    records.append(view[offset:offset + length])
+                data = b"".join(records)
+                del records
+            atomic_write(self.path, data)
+            self._reset()
+            return size - len(data)
@@ -0,0 +1,159 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+from .journal import JournaledIndex
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Title words count as many times as this in the entry
+TITLE_WEIGHT = 5
+# Postings scored for a term, those of the entries where it is the most frequent
+SCORED_POSTINGS = 1000
+
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Returns the list of lowercase words of a text.
+    """
+    return WORD.findall(text.lower())
+
+
+def entry_terms(title, content):
+    """
+    Returns the term frequencies of an entry, title words included.
+    """
+    terms = Counter(tokenize(content))
+    for term in tokenize(title):
+        terms[term] += TITLE_WEIGHT
+    return terms
+
+
+class SearchIndex(JournaledIndex):
+    """
+    Inverted index of the encyclopedia entries, ranking matches with BM25.
+
+    The index is journaled (see JournaledIndex): saving an entry only appends a line
+    to the journal. `manage.py wiki_search_index` rebuilds the snapshot.
+    """
+
+    def __init__(self, directory="search"):
+        super().__init__(directory)
+
+    def _reset(self):
+        # term -> {title: frequency}
+        self.postings = {}
+        # title -> number of terms
+        self.lengths = {}
+        self._total_length = 0
+        # term -> [(title, frequency)] scored for the terms having more than SCORED_POSTINGS postings
+        self._scored = {}
+
+    def _snapshot(self):
+        return {"postings": self.postings, "lengths": self.lengths}
+
+    def _restore(self, snapshot):
+        self.postings = snapshot["postings"]
+        self.lengths = snapshot["lengths"]
+        self._total_length = sum(self.lengths.values())
+        self._scored = {}
+
+    def _add(self, title, terms):
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[title] = frequency
+            self._scored.pop(term, None)
+        length = sum(terms.values())
+        self.lengths[title] = length
+        self._total_length += length
+
+    def _remove(self, title, terms=None):
+        if title not in self.lengths:
+            return
+        # without the entry terms, every posting list has to be checked
+        if terms is None:
+            terms = list(self.postings)
+            self._scored = {}
+        for term in terms:
+            documents = self.postings.get(term)
+            if documents and documents.pop(title, None) is not None and not documents:
+                del self.postings[term]
+            self._scored.pop(term, None)
+        self._total_length -= self.lengths.pop(title)
+
+    def _apply(self, change):
+        self._remove(change["title"], change["remove"])
+        if change["add"] is not None:
+            self._add(change["title"], change["add"])
+
+    def _sync(self, titles):
+        """
+        Indexes entries added and drops entries removed without save_entry.
+        """
+        if titles is self._synced_titles:
+            return
+        from . import util
+
+        current = set(titles)
+        for title in set(self.lengths) - current:
+            self._remove(title)
+        for title in current - set(self.lengths):
+            content = util.get_entry(title)
+            if content is not None:
+                self._add(title, entry_terms(title, content))
+        self._synced_titles = titles
+
+    def update(self, title, old_content, new_content):
+        """
+        Records that an entry content changed (None meaning a missing entry).
+        """
+        self._append({
+            "title": title,
+            "remove": list(entry_terms(title, old_content)) if old_content is not None else [],
+            "add": entry_terms(title, new_content) if new_content is not None else None,
+        })
+
+    def _scored_postings(self, term, documents):
+        """
+        Returns the (title, frequency) postings of a term to score: all of them for most terms,
+        and for common ones only the SCORED_POSTINGS where the term is the most frequent.
+        """
+        if len(documents) <= SCORED_POSTINGS:
+            return documents.items()
+        scored = self._scored.get(term)
+        if scored is None:
+            scored = self._scored[term] = heapq.nlargest(SCORED_POSTINGS, documents.items(), key=lambda item: item[1])
+        return scored
+
+    def search(self, query, limit=50):
+        """
+        Returns the titles of the entries best matching the query, best first.
+
+        Entries where a common term is less frequent than in SCORED_POSTINGS others
+        are not scored for it, so that queries of common terms take bounded time.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            self._current()
+            count = len(self.lengths)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            scores = Counter()
+            for term in terms:
+                documents = self.postings.get(term)
+                if not documents:
+                    continue
+                idf = math.log(1 + (count - len(documents) + 0.5) / (len(documents) + 0.5))
+                for title, frequency in self._scored_postings(term, documents):
+                    norm = K1 * (1 - B + B * self.lengths[title] / average_length)
+                    scores[title] += idf * frequency * (K1 + 1) / (frequency + norm)
+        return [title for title, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1])]
+
+
+search_index = SearchIndex()
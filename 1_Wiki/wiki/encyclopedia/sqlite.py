@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .search import TITLE_WEIGHT, tokenize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL UNIQUE,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modified REAL NOT NULL
+);
+
+-- full-text index of the entries, and trigram index of the titles for substring search
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_text USING fts5(
+    title, content, content='entries', content_rowid='id'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_titles USING fts5(
+    title, content='entries', content_rowid='id', tokenize='trigram'
+);
+
+-- version changes whenever an entry is added or removed
+CREATE TABLE IF NOT EXISTS state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL,
+    modified REAL NOT NULL
+);
+INSERT OR IGNORE INTO state VALUES (0, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_text (rowid, title, content) VALUES (new.id, new.title, new.content);
+    INSERT INTO entries_titles (rowid, title) VALUES (new.id, new.title);
+    UPDATE state SET version = version + 1, modified = new.modified;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE ON entries BEGIN
+    INSERT INTO entries_text (entries_text, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    INSERT INTO entries_text (rowid, title, content) VALUES (new.id, new.title, new.content);
+    INSERT INTO entries_titles (entries_titles, rowid, title) VALUES ('delete', old.id, old.title);
+    INSERT INTO entries_titles (rowid, title) VALUES (new.id, new.title);
+    UPDATE state SET modified = new.modified;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_text (entries_text, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    INSERT INTO entries_titles (entries_titles, rowid, title) VALUES ('delete', old.id, old.title);
+    UPDATE state SET version = version + 1, modified = (julianday('now') - 2440587.5) * 86400.0;
+END;
+"""
+
+UPSERT = """
+INSERT INTO entries (title, content, size, modified) VALUES (?, ?, ?, ?)
+ON CONFLICT (title) DO UPDATE SET content = excluded.content, size = excluded.size, modified = excluded.modified
+"""
+
+
+def _datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+class SQLiteEntryStorage:
+    """
+    Stores the entries in a SQLite database, indexed with FTS5.
+
+    Besides the methods of the other entry storages, it provides `search()`,
+    `titles_containing()` and `random()`, each a single indexed query, used
+    instead of the process-level search index, title scan and title index.
+    """
+
+    def __init__(self, name="entries.sqlite3"):
+        self.name = name
+        self._local = threading.local()
+
+    @property
+    def path(self):
+        return default_storage.path(self.name)
+
+    @property
+    def connection(self):
+        """
+        Connection of the current thread to the database.
+        """
+        path = self.path
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        if path not in connections:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            connection = sqlite3.connect(path, timeout=30)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(SCHEMA)
+            connections[path] = connection
+        return connections[path]
+
+    def _value(self, query, *params):
+        row = self.connection.execute(query, params).fetchone()
+        return row[0] if row is not None else None
+
+    def version(self):
+        return self.path, self._value("SELECT version FROM state")
+
+    def modified_time(self):
+        return _datetime(self._value("SELECT modified FROM state"))
+
+    def titles(self):
+        return [title for title, in self.connection.execute("SELECT title FROM entries ORDER BY title")]
+
+    def read(self, title):
+        return self._value("SELECT content FROM entries WHERE title = ?", title)
+
+    def write(self, title, content):
+        self.write_many([(title, content)])
+
+    def write_many(self, entries):
+        """
+        Saves several entries, given an iterable of (title, content) pairs, in a single transaction.
+        """
+        now = time.time()
+        with self.connection as connection:
+            connection.executemany(UPSERT, ((title, content, len(content.encode()), now)
+                                            for title, content in entries))
+
+    def size(self, title):
+        return self._value("SELECT size FROM entries WHERE title = ?", title)
+
+    def entry_modified_time(self, title):
+        modified = self._value("SELECT modified FROM entries WHERE title = ?", title)
+        return _datetime(modified) if modified is not None else None
+
+    def iter_lines(self, title):
+        content = self.read(title)
+        if content is None:
+            raise FileNotFoundError(title)
+        yield from content.split("\n")
+
+    def search(self, query, limit=50):
+        """
+        Returns the titles of the entries best matching the query, best first.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        return [title for title, in self.connection.execute(
+            "SELECT title FROM entries_text WHERE entries_text MATCH ? "
+            "ORDER BY bm25(entries_text, ?, 1.0) LIMIT ?",
+            (" OR ".join(f'"{term}"' for term in terms), TITLE_WEIGHT, limit))]
+
+    def titles_containing(self, query):
+        """
+        Returns the sorted titles having the query as substring, regardless of case.
+        """
+        if len(query) < 3:
+            # shorter than a trigram: nothing to look up in the index
+            return [title for title in self.titles() if query.lower() in title.lower()]
+        phrase = '"' + query.replace('"', '""') + '"'
+        return [title for title, in self.connection.execute(
+            "SELECT title FROM entries_titles WHERE entries_titles MATCH ? ORDER BY title", (phrase,))]
+
+    def random(self):
+        """
+        Returns a random title, or None if there are no entries.
+        """
+        return self._value("SELECT title FROM entries "
+                           "WHERE id >= (SELECT abs(random()) % max(id) + 1 FROM entries) ORDER BY id LIMIT 1")
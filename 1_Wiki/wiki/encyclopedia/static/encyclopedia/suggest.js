@@ -0,0 +1,32 @@
+// Suggests entry titles in the sidebar search box as the query is typed
+document.addEventListener('DOMContentLoaded', function() {
+    const search = document.querySelector('.search');
+    const suggestions = document.querySelector('#suggestions');
+    let timer = null;
+
+    search.addEventListener('input', function() {
+        // wait for a pause in typing before asking for suggestions
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            const query = search.value;
+            if (!query) {
+                suggestions.innerHTML = '';
+                return;
+            }
+            fetch(`${search.dataset.suggestUrl}?q=${encodeURIComponent(query)}`)
+            .then(response => response.json())
+            .then(result => {
+                // ignore responses to outdated queries
+                if (result.query !== search.value) {
+                    return;
+                }
+                suggestions.innerHTML = '';
+                result.titles.forEach(title => {
+                    const option = document.createElement('option');
+                    option.value = title;
+                    suggestions.append(option);
+                });
+            });
+        }, 100);
+    });
+});
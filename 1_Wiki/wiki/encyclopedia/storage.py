@@ -0,0 +1,109 @@
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
+
+# Entry storage instances, by class path
+_storages = {}
+
+
+def file_permissions():
+    """
+    Returns the mode of the files written, FILE_UPLOAD_PERMISSIONS or else the mode new files get.
+    """
+    if settings.FILE_UPLOAD_PERMISSIONS is not None:
+        return settings.FILE_UPLOAD_PERMISSIONS
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def atomic_write(path, data):
+    """
+    Writes data (bytes) to a file through a temporary file renamed over it,
+    so that readers see either the old or the new file, never a partial one.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # mkstemp files are only readable by their owner: give them the permissions of saved files
+            os.fchmod(f.fileno(), file_permissions())
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_entry_storage():
+    """
+    Returns the storage of the encyclopedia entries selected by the
+    WIKI_ENTRY_STORAGE setting.
+    """
+    path = settings.WIKI_ENTRY_STORAGE
+    if path not in _storages:
+        _storages[path] = import_string(path)()
+    return _storages[path]
+
+
+class FileEntryStorage:
+    """
+    Stores each entry as a Markdown file in the entries folder of the default storage.
+
+    Entry storages provide the same methods: `version()` changes whenever an entry
+    is added or removed, `modified_time()` is the datetime of the last such change,
+    `write_many()` saves an iterable of (title, content) pairs at once, and the other
+    methods take an entry title and return None if there is no such entry (except
+    `iter_lines()` which raises FileNotFoundError).
+    """
+
+    def version(self):
+        return default_storage.get_modified_time("entries")
+
+    def modified_time(self):
+        return default_storage.get_modified_time("entries")
+
+    def titles(self):
+        _, filenames = default_storage.listdir("entries")
+        return sorted(re.sub(r"\.md$", "", filename) for filename in filenames if filename.endswith(".md"))
+
+    def read(self, title):
+        try:
+            with default_storage.open(f"entries/{title}.md", "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, title, content):
+        atomic_write(default_storage.path(f"entries/{title}.md"), content.encode())
+
+    def write_many(self, entries):
+        for title, content in entries:
+            self.write(title, content)
+
+    def size(self, title):
+        try:
+            return default_storage.size(f"entries/{title}.md")
+        except FileNotFoundError:
+            return None
+
+    def entry_modified_time(self, title):
+        try:
+            return default_storage.get_modified_time(f"entries/{title}.md")
+        except FileNotFoundError:
+            return None
+
+    def iter_lines(self, title):
+        with default_storage.open(f"entries/{title}.md", "r") as f:
+            line = ""
+            for line in f:
+                yield line[:-1] if line.endswith("\n") else line
+            if not line or line.endswith("\n"):
+                yield ""
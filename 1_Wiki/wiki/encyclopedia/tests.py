@@ -1,3 +1,816 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tarfile
+import tempfile
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import Client, RequestFactory, TestCase, override_settings
+
+from . import history, links, markdown, search, util, views
+from .cache import LRUCache
+from .pack import PackEntryStorage
+from .management.commands.wiki_bench import generate_entry, legacy_markdown_to_html
+
+
+class MarkdownTestCase(TestCase):
+
+    def test_entries_render_as_legacy_renderer(self):
+        """Every entry of the encyclopedia must render exactly as with the original regex renderer"""
+        for title in util.list_entries():
+            content = util.get_entry(title)
+            self.assertEqual(util.markdown_to_html(content), legacy_markdown_to_html(content), title)
+
+    def test_synthetic_entry_blocks(self):
+        """Headings, lists and paragraphs of a generated entry must be converted"""
+        html = util.markdown_to_html(generate_entry(8192))
+        for tag in ["<h", "<ul>", "<ol>", "<li>", "<p>", "<strong>", "<em>", "<code>", "<a href="]:
+            self.assertIn(tag, html)
+        self.assertNotIn("**", html)
+
+    def test_inline_elements(self):
+        """Inline elements are matched in a single scan, links text being rendered too"""
+        self.assertEqual(util.markdown_to_html("**bold** *italic* `co**de**`"),
+                         "<strong>bold</strong> <em>italic</em> <code>co**de**</code>")
+        self.assertEqual(util.markdown_to_html("[**Python**](/wiki/Python)"),
+                         '<a href="/wiki/Python"><strong>Python</strong></a>')
+
+    def test_inline_elements_as_regex(self):
+        """Inline elements must be matched as the regular expression documented by inline_elements()"""
+        regex = re.compile(r"\*\*([^*]+)\*\*|\*([^ *][^*]+)\*|`([^`]+)`|\[([^]]+)\]\(([^)]+)\)")
+        kinds = ["strong", "em", "code", "link", "link"]
+        rng = random.Random(0)
+        for i in range(5000):
+            text = "".join(rng.choices("*`[]() a\n", k=rng.randint(0, 30)))
+            expected = []
+            for match in regex.finditer(text):
+                kind = kinds[match.lastindex - 1]
+                value = match.group(4) if kind == "link" else match.group(match.lastindex)
+                expected.append((match.start(), match.end(), kind, value, match.group(5)))
+            self.assertEqual(list(markdown.inline_elements(text)), expected, repr(text))
+
+    def test_pathological_entries_budget(self):
+        """Pathological entries must render within the time budget per KB, at 4 and 16KB"""
+        call_command("wiki_bench", "fuzz", "--fuzz-size", "4", "--repeat", "1", "--budget", "20",
+                     stdout=io.StringIO())
+
+    def test_headings(self):
+        """Headings must get unique anchors from their text, and be collected in the same pass"""
+        headings = []
+        html = markdown.render("# Python\n\n## **Syntax**\n\ntext\n\n## Syntax\n\n### Caf\xe9!\n", headings=headings)
+        self.assertIn('<h2 id="syntax"><strong>Syntax</strong></h2>', html)
+        self.assertIn('<h2 id="syntax-2">Syntax</h2>', html)
+        self.assertEqual(headings, [(1, "Python", "python"), (2, "Syntax", "syntax"), (2, "Syntax", "syntax-2"),
+                                    (3, "Caf\xe9!", "caf\xe9")])
+        self.assertNotIn(" id=", util.markdown_to_html("# Python\n"))
+
+    def test_paragraph_wrapping(self):
+        """Only blocks between a blank line and a line break followed by a blank line are wrapped"""
+        self.assertEqual(util.markdown_to_html("# Title\n\nfirst\nsecond\n\n1. one\n2. two\n"),
+                         "<h1>Title</h1>\n\n<p>first\nsecond</p>\n\n<ol>\n<li>one</li>\n<li>two</li>\n</ol>\n")
+        self.assertEqual(util.markdown_to_html("text\n\nlast"), "text\n\nlast")
+
+
+class EntriesTestCase(TestCase):
+    """Define shared setUp() using a temporary entries folder"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        caches["wiki"].clear()
+        util.block_cache.clear()
+        util.missing_entries.clear()
+        util.save_entry("Python", "# Python\n\n**Python** is a programming language.\n")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+
+class RenderCacheTestCase(EntriesTestCase):
+
+    def test_entry_rendered_once(self):
+        """Viewing an entry twice must render it only once"""
+        hits, misses = util.render_cache_stats["hits"], util.render_cache_stats["misses"]
+        for i in range(2):
+            response = self.client.get("/wiki/Python")
+            self.assertContains(response, "<strong>Python</strong>")
+        self.assertEqual(util.render_cache_stats["misses"], misses + 1)
+        self.assertEqual(util.render_cache_stats["hits"], hits + 1)
+
+    def test_save_entry_invalidates(self):
+        """Saving an entry must drop the rendering of its previous content"""
+        old_key = util.html_cache_key(util.get_entry("Python"))
+        self.client.get("/wiki/Python")
+        self.assertIsNotNone(caches["wiki"].get(old_key))
+
+        util.save_entry("Python", "# Python\n\n*edited*\n")
+        self.assertIsNone(caches["wiki"].get(old_key))
+        self.assertContains(self.client.get("/wiki/Python"), "<em>edited</em>")
+
+    def test_edit_renders_changed_blocks_only(self):
+        """Viewing an edited entry must render again only its changed blocks"""
+        content = generate_entry(20000)
+        util.save_entry("Large", content)
+        self.client.get("/wiki/Large")
+        # headings are rendered with their anchors, outside of the blocks cache
+        blocks = len([block for block in markdown.tokenize(content.split("\n"))
+                      if block.kind not in ("blank", "heading")])
+        self.assertGreater(util.block_cache.usage, 0)
+
+        lines = content.split("\n")
+        lines[len(lines) // 2] += " edited"
+        util.save_entry("Large", "\n".join(lines))
+        hits, misses = util.render_cache_stats["block_hits"], util.render_cache_stats["block_misses"]
+        response = self.client.get("/wiki/Large")
+        self.assertContains(response, markdown.render("\n".join(lines), headings=[]))
+        self.assertEqual(util.render_cache_stats["block_misses"], misses + 1)
+        self.assertEqual(util.render_cache_stats["block_hits"], hits + blocks - 1)
+
+    def test_block_cache_eviction(self):
+        """Least recently used blocks are evicted once the memory budget is exceeded"""
+        blocks = [markdown.Block("paragraph", (letter * 100,), False) for letter in "abcd"]
+        with self.settings(WIKI_BLOCK_CACHE_BYTES=600):
+            for block in blocks[:3]:
+                util.block_cache.set(block, markdown.render_block(block))
+            util.block_cache.get(blocks[0])
+            util.block_cache.set(blocks[3], markdown.render_block(blocks[3]))
+        self.assertIsNone(util.block_cache.get(blocks[1]))
+        for block in [blocks[0], blocks[2], blocks[3]]:
+            self.assertEqual(util.block_cache.get(block), block.lines[0])
+        self.assertLessEqual(util.block_cache.usage, 600)
+
+    def test_table_of_contents(self):
+        """Entry pages with several headings must have a table of contents, cached with their HTML"""
+        util.save_entry("Python", "# Python\n\n## History\n\n## Syntax\n")
+        response = self.client.get("/wiki/Python")
+        self.assertContains(response, '<a href="#history">History</a>')
+        self.assertContains(response, '<h2 id="history">History</h2>')
+        misses = util.render_cache_stats["misses"]
+        self.assertEqual(self.client.get("/wiki/Python").context["toc"][2], (2, "Syntax", "syntax"))
+        self.assertEqual(util.render_cache_stats["misses"], misses)
+
+        util.save_entry("Python", "# Python\n")
+        self.assertNotContains(self.client.get("/wiki/Python"), "Contents")
+
+    def test_lru_eviction(self):
+        """Least recently used values are evicted once the memory budget is exceeded"""
+        cache = LRUCache("test-lru", {"TIMEOUT": None, "OPTIONS": {"MAX_BYTES": 3000}})
+        cache.clear()
+        for key in ["a", "b", "c"]:
+            cache.set(key, "x" * 900)
+        cache.get("a")
+        cache.set("d", "x" * 900)
+        self.assertIsNone(cache.get("b"))
+        for key in ["a", "c", "d"]:
+            self.assertIsNotNone(cache.get(key))
+        self.assertLessEqual(cache.usage, 3000)
+
+
+    def test_render_timeout(self):
+        """Entries taking too long to render must be shown as plain text, without trying again on each view"""
+        util.save_entry("Slow", "# <Slow>\n")
+        timeouts = util.render_cache_stats["timeouts"]
+        with self.settings(WIKI_RENDER_TIMEOUT=-1):
+            self.assertContains(self.client.get("/wiki/Slow"), "<pre># &lt;Slow&gt;\n</pre>")
+            self.client.get("/wiki/Slow")
+        self.assertEqual(util.render_cache_stats["timeouts"], timeouts + 1)
+
+
+class TitleIndexTestCase(EntriesTestCase):
+
+    def test_index_follows_saved_entries(self):
+        """Saved entries must be listed, in order, without waiting for the folder mtime to change"""
+        self.assertEqual(util.list_entries(), ["Python"])
+        util.save_entry("Django", "# Django\n")
+        self.assertEqual(util.list_entries(), ["Django", "Python"])
+
+    def test_index_follows_folder_changes(self):
+        """Entries added to the folder by other means must be listed too"""
+        util.list_entries()
+        entries_dir = os.path.join(self.media_root, "entries")
+        mtime = os.stat(entries_dir).st_mtime
+        with open(os.path.join(entries_dir, "CSS.md"), "w") as f:
+            f.write("# CSS\n")
+        # filesystem timestamps are coarse: make sure the folder looks modified
+        os.utime(entries_dir, (mtime + 1, mtime + 1))
+        self.assertIn("CSS", util.list_entries())
+
+    def test_find_entry(self):
+        """Exact lookup must ignore case"""
+        self.assertEqual(util.find_entry("pYTHON"), "Python")
+        self.assertIsNone(util.find_entry("Pyth"))
+
+    def test_search_redirects_to_entry(self):
+        """Searching an entry title in another case must redirect to the entry"""
+        response = self.client.post("/", {"q": "python"})
+        self.assertRedirects(response, "/wiki/Python")
+
+    def test_complete_entries(self):
+        """Titles starting with the prefix must be completed regardless of case, up to the limit"""
+        for title in ["Pythonic", "pyramid", "Django", "Py"]:
+            util.save_entry(title, f"# {title}\n")
+        self.assertEqual(util.complete_entries("py"), ["Py", "pyramid", "Python", "Pythonic"])
+        self.assertEqual(util.complete_entries("PYTH", limit=1), ["Python"])
+        self.assertEqual(util.complete_entries("pz"), [])
+        self.assertEqual(util.complete_entries(""), [])
+
+    def test_suggest_api(self):
+        """Suggestions must be returned as JSON, with cache headers"""
+        response = self.client.get("/api/suggest", {"q": "pyt"})
+        self.assertEqual(response.json(), {"query": "pyt", "titles": ["Python"]})
+        self.assertIn("max-age=60", response["Cache-Control"])
+        response = self.client.get("/api/suggest", {"q": "pyt"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_random_entry(self):
+        response = self.client.get("/random")
+        self.assertRedirects(response, "/wiki/Python")
+
+
+class SearchTestCase(EntriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        util.save_entry("Django", "# Django\n\nDjango is a web framework written in Python.\n")
+        util.save_entry("HTML", "# HTML\n\nHTML is a markup language.\n")
+
+    def test_ranked_search(self):
+        """Entries matching in their title must rank before entries matching only in their content"""
+        self.assertEqual(util.search_entries("python"), ["Python", "Django"])
+        self.assertEqual(util.search_entries("markup"), ["HTML"])
+
+    def test_incremental_update(self):
+        """Saved entries must be searchable without rebuilding the index"""
+        util.search_entries("python")
+        util.save_entry("HTML", "# HTML\n\nHTML pages are generated by Django.\n")
+        self.assertEqual(util.search_entries("markup"), [])
+        self.assertEqual(util.search_entries("generated"), ["HTML"])
+
+    def test_index_persistence(self):
+        """A new index must load the snapshot and replay the journal"""
+        util.search_entries("python")
+        util.save_entry("CSS", "# CSS\n\nCSS adds style to HTML pages.\n")
+        index = search.SearchIndex()
+        self.assertEqual(index.search("style"), ["CSS"])
+        self.assertEqual(search.search_index.search("style"), ["CSS"])
+        self.assertEqual(index.postings, search.search_index.postings)
+
+    def test_search_results_page(self):
+        """Search results page must list content matches and title substring matches"""
+        response = self.client.post("/", {"q": "framew"})
+        self.assertEqual(response.context["entries"], [])
+        response = self.client.post("/", {"q": "HT"})
+        self.assertEqual(response.context["entries"], ["HTML"])
+        response = self.client.post("/", {"q": "framework"})
+        self.assertEqual(response.context["entries"], ["Django"])
+
+    def test_title_substrings(self):
+        """Title substring matches must be found in the trigram index, regardless of case"""
+        util.save_entry("JavaScript", "# JavaScript\n")
+        for query, titles in [("ytho", ["Python"]), ("SCRIPT", ["JavaScript"]), ("an", ["Django"]),
+                              ("ml", ["HTML"]), ("on", ["Python"]), ("xyz", [])]:
+            self.assertEqual(util.search_entries(query), titles)
+
+    @patch("encyclopedia.search.SCORED_POSTINGS", 2)
+    def test_common_terms_postings_capped(self):
+        """Only the postings of the entries where a common term is the most frequent must be scored"""
+        util.save_entry("CSS", "# CSS\n\nCSS styles HTML pages, HTML and HTML again.\n")
+        util.save_entry("JavaScript", "# JavaScript\n\nJavaScript runs in HTML pages.\n")
+        self.assertEqual(util.search_entries("html"), ["HTML", "CSS"])
+        util.save_entry("JavaScript", "# JavaScript\n\nHTML HTML HTML HTML HTML HTML.\n")
+        self.assertEqual(util.search_entries("html"), ["HTML", "JavaScript"])
+
+
+class FuzzyTestCase(EntriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        util.save_entry("Django", "# Django\n")
+        util.save_entry("JavaScript", "# JavaScript\n")
+
+    def test_suggest_misspelled_title(self):
+        """Misspelled titles must be suggested, closest first"""
+        self.assertEqual(util.suggest_entries("Pyhton"), ["Python"])
+        self.assertEqual(util.suggest_entries("javscript"), ["JavaScript"])
+        self.assertEqual(util.suggest_entries("xyz"), [])
+
+    def test_suggestions_follow_saved_entries(self):
+        """Saved entries must be suggested"""
+        self.assertEqual(util.suggest_entries("Jango"), ["Django"])
+        util.save_entry("Jinja", "# Jinja\n")
+        self.assertEqual(util.suggest_entries("Jinga"), ["Jinja"])
+
+    def test_did_you_mean(self):
+        """Search results page must suggest the entries close to a misspelled query"""
+        response = self.client.post("/", {"q": "Djnago"})
+        self.assertEqual(response.context["suggestions"], ["Django"])
+        self.assertContains(response, "Did you mean")
+
+
+class HistoryTestCase(EntriesTestCase):
+
+    def test_atomic_save(self):
+        """Saving must replace the entry without leaving temporary files"""
+        util.save_entry("Python", "# Python\r\n\r\nEdited.\r\n")
+        self.assertEqual(util.get_entry("Python"), "# Python\n\nEdited.\n")
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "entries")), ["Python.md"])
+
+    def test_revisions(self):
+        """Every saved content must be recorded and restorable"""
+        contents = [util.get_entry("Python")]
+        for i in range(history.KEYFRAME_INTERVAL + 5):
+            contents.append(contents[-1] + f"\nLine {i}\n")
+            util.save_entry("Python", contents[-1])
+        revisions = history.list_revisions("Python")
+        self.assertEqual(len(revisions), len(contents))
+        for revision, content in zip(revisions, contents):
+            self.assertEqual(history.get_revision("Python", revision["number"]), content)
+
+    def test_revisions_are_deltas(self):
+        """Revisions must not store full copies of the entry"""
+        content = "\n".join(f"Line {i}" for i in range(1000)) + "\n"
+        util.save_entry("Python", content)
+        util.save_entry("Python", content + "One more line\n")
+        size = os.path.getsize(os.path.join(self.media_root, "revisions", "Python.jsonl"))
+        self.assertLess(size, 1.5 * len(content))
+
+    def test_external_edit_recorded(self):
+        """Content changed outside the wiki must be recorded before the new revision"""
+        with open(os.path.join(self.media_root, "entries", "Python.md"), "w") as f:
+            f.write("# Python\n\nExternal edit.\n")
+        util.save_entry("Python", "# Python\n\nWiki edit.\n")
+        self.assertEqual(history.get_revision("Python", 2), "# Python\n\nExternal edit.\n")
+        self.assertEqual(history.get_revision("Python", 3), "# Python\n\nWiki edit.\n")
+
+    def test_history_pages(self):
+        util.save_entry("Python", "# Python\n\nEdited.\n")
+        response = self.client.get("/history/Python")
+        self.assertEqual([revision["number"] for revision in response.context["revisions"]], [2, 1])
+        response = self.client.get("/history/Python/2")
+        self.assertContains(response, "+Edited.")
+        response = self.client.get("/history/Python/3")
+        self.assertContains(response, "Page not found")
+
+    def test_history_of_entry_saved_outside_wiki(self):
+        """Entries without recorded revisions must have their current content as first revision"""
+        with open(os.path.join(self.media_root, "entries", "Django.md"), "w") as f:
+            f.write("# Django\n\nImported.\n")
+        response = self.client.get("/history/Django")
+        self.assertEqual([revision["number"] for revision in response.context["revisions"]], [1])
+        response = self.client.get("/history/Django/1")
+        self.assertContains(response, "+Imported.")
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "revisions", "Django.jsonl")))
+        util.save_entry("Django", "# Django\n\nEdited.\n")
+        self.assertEqual(history.get_revision("Django", 1), "# Django\n\nImported.\n")
+        self.assertEqual(history.get_revision("Django", 2), "# Django\n\nEdited.\n")
+        response = self.client.get("/history/Missing")
+        self.assertContains(response, "Page not found")
+
+    def test_invalid_titles_refused(self):
+        """Titles escaping the entries directory must be refused without writing anything"""
+        before = sorted(os.listdir(self.media_root))
+        for title in ["../evil", ".hidden", "..", "a/b", "a\\b"]:
+            with self.assertRaises(ValueError):
+                util.save_entry(title, "# Evil\n")
+            response = self.client.post("/create", {"title": title, "content": "# Evil\n"})
+            self.assertContains(response, "Titles can&#x27;t contain slashes")
+        response = self.client.post("/edit/..", {"content": "# Evil\n"})
+        self.assertContains(response, "Titles can&#x27;t contain slashes")
+        self.assertEqual(sorted(os.listdir(self.media_root)), before)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "revisions")), ["Python.jsonl"])
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.media_root), "evil.md")))
+
+    def test_atomic_write_permissions(self):
+        """Files written atomically must get the permissions of saved files, not those of temporary files"""
+        path = os.path.join(self.media_root, "entries", "Python.md")
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+        with self.settings(FILE_UPLOAD_PERMISSIONS=0o640):
+            util.save_entry("Python", "# Python\n")
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        with self.settings(FILE_UPLOAD_PERMISSIONS=None):
+            umask = os.umask(0o027)
+            try:
+                util.save_entry("Python", "# Python\n")
+            finally:
+                os.umask(umask)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+
+class MissingEntriesTestCase(EntriesTestCase):
+
+    def test_missing_entry_looked_up_once(self):
+        """Requests for a missing entry must reach the storage only once, until it is saved"""
+        self.assertContains(self.client.get("/wiki/Missing"), "not found", status_code=200)
+        misses = util.entry_lookup_stats["misses"]
+        with patch.object(util.get_entry_storage(), "read") as read:
+            self.client.get("/wiki/Missing")
+        read.assert_not_called()
+        self.assertEqual(util.entry_lookup_stats["misses"], misses)
+
+        util.save_entry("Missing", "# Missing\n")
+        self.assertContains(self.client.get("/wiki/Missing"), "<h1")
+
+    def test_expiry_and_bound(self):
+        with self.settings(WIKI_MISSING_CACHE_TTL=-1):
+            self.assertIsNone(util.get_entry("Missing"))
+            self.assertNotIn("Missing", util.missing_entries)
+        with self.settings(WIKI_MISSING_CACHE_SIZE=2):
+            for title in ["A", "B", "C"]:
+                util.get_entry(title)
+            self.assertEqual(len(util.missing_entries), 2)
+            self.assertNotIn("A", util.missing_entries)
+
+    def test_create_after_cached_miss(self):
+        """Creating a page must check the storage, not the cache of missing entries"""
+        util.get_entry("CSS")
+        with open(os.path.join(self.media_root, "entries", "CSS.md"), "w") as f:
+            f.write("# CSS\n")
+        response = self.client.post("/create", {"title": "CSS", "content": "# Other\n"})
+        self.assertContains(response, "This page already exists")
+
+    def test_stats(self):
+        util.get_entry("Python")
+        util.get_entry("Missing")
+        util.get_entry("Missing")
+        lookups = self.client.get("/api/stats").json()["entry_lookups"]
+        self.assertGreater(lookups["miss_rate"], 0)
+        self.assertGreater(lookups["cached_miss_rate"], 0)
+
+
+class LinkGraphTestCase(EntriesTestCase):
+
+    def test_extract_links(self):
+        content = "[Django](/wiki/Django), [C%2B%2B](/wiki/C%2B%2B), [again](/wiki/Django), [web](https://a.org)"
+        self.assertEqual(links.extract_links(content), ["C++", "Django"])
+
+    def test_backlinks_follow_saved_entries(self):
+        """Backlinks must be listed on entry pages, and updated when linking entries are edited"""
+        util.save_entry("Django", "# Django\n\nA framework in [Python](/wiki/python).\n")
+        self.assertEqual(util.entry_backlinks("Python"), ["Django"])
+        response = self.client.get("/wiki/Python")
+        self.assertContains(response, "What links here")
+        self.assertContains(response, 'href="/wiki/Django"')
+
+        util.save_entry("Django", "# Django\n\nA framework.\n")
+        self.assertEqual(util.entry_backlinks("Python"), [])
+        self.assertNotContains(self.client.get("/wiki/Python"), "What links here")
+
+    def test_orphans(self):
+        """Entries without links from other entries must be listed as orphans"""
+        util.save_entry("Django", "# Django\n\nSee [Python](/wiki/Python) and [Django](/wiki/Django).\n")
+        self.assertEqual(util.orphan_entries(), ["Django"])
+        self.assertEqual(self.client.get("/orphans").context["entries"], ["Django"])
+
+    def test_persistence(self):
+        """A new graph must load the saved links, entries added to the folder included"""
+        util.save_entry("Django", "[Python](/wiki/Python)")
+        with open(os.path.join(self.media_root, "entries", "Flask.md"), "w") as f:
+            f.write("[Python](/wiki/Python)")
+        util.title_index.invalidate()
+        graph = links.LinkGraph()
+        self.assertEqual(graph.backlinks("Python"), ["Django", "Flask"])
+
+        call_command("wiki_link_graph", stdout=io.StringIO())
+        self.assertEqual(links.LinkGraph().backlinks("Python"), ["Django", "Flask"])
+
+    def test_entry_revalidated_when_backlinks_change(self):
+        """Entry pages must not be reported unmodified when their backlinks changed"""
+        etag = self.client.get("/wiki/Python")["ETag"]
+        self.assertEqual(self.client.get("/wiki/Python", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        util.save_entry("Django", "[Python](/wiki/Python)")
+        self.assertEqual(self.client.get("/wiki/Python", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class StreamingTestCase(EntriesTestCase):
+
+    def test_large_entry_streamed(self):
+        """Entries above the streaming threshold must be streamed, with the same HTML as when rendered at once"""
+        content = generate_entry(200 * 1024)
+        util.save_entry("Large", content)
+        with self.settings(WIKI_STREAMING_THRESHOLD=100 * 1024):
+            response = self.client.get("/wiki/Large")
+        self.assertTrue(response.streaming)
+        page = b"".join(response.streaming_content).decode()
+        self.assertIn(markdown.render(content, headings=[]), page)
+        self.assertIn("<title>", page)
+        self.assertTrue(page.rstrip().endswith("</html>"))
+
+    def test_small_entry_not_streamed(self):
+        response = self.client.get("/wiki/Python")
+        self.assertFalse(response.streaming)
+
+    def test_render_chunks(self):
+        """Chunks must join into the document rendered at once, ending with or without a line break"""
+        for content in [generate_entry(10000), "# Title\n\ntext", "", "\n"]:
+            chunks = list(markdown.render_chunks(content.split("\n"), chunk_size=1000))
+            self.assertEqual("".join(chunks), util.markdown_to_html(content))
+
+
+class AsyncViewsTestCase(EntriesTestCase):
+
+    async def test_entry(self):
+        """Async entry view must render the entry page on a view thread, and answer conditional requests"""
+        response = await views.async_entry(RequestFactory().get("/wiki/Python"), "Python")
+        self.assertContains(response, '<h1 id="python">Python</h1>')
+        request = RequestFactory().get("/wiki/Python", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual((await views.async_entry(request, "Python")).status_code, 304)
+
+    async def test_large_entry_rendered_on_view_thread(self):
+        """Large entries must be rendered at once by the async entry view rather than streamed"""
+        content = generate_entry(200 * 1024)
+        util.save_entry("Large", content)
+        with self.settings(WIKI_STREAMING_THRESHOLD=100 * 1024):
+            response = await views.async_entry(RequestFactory().get("/wiki/Large"), "Large")
+        self.assertFalse(response.streaming)
+        self.assertIn(markdown.render(content, headings=[]), response.content.decode())
+        self.assertIn("ETag", response)
+
+    async def test_edit(self):
+        response = await views.async_edit(RequestFactory().post("/edit/Python", {"content": "# Python\n\nAsync.\n"}),
+                                          "Python")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(util.get_entry("Python"), "# Python\n\nAsync.\n")
+
+    def test_index_csrf_exempt(self):
+        self.assertTrue(views.async_index.csrf_exempt)
+
+
+class ImportExportTestCase(EntriesTestCase):
+
+    def test_export_import_directory(self):
+        """Entries exported to a directory must be imported back identically"""
+        util.save_entry("Django", "# Django\n\nA **framework**.\n")
+        destination = os.path.join(self.media_root, "dump")
+        call_command("wiki_export", destination, stdout=io.StringIO())
+        self.assertEqual(sorted(os.listdir(destination)), ["Django.md", "Python.md"])
+
+        util.save_entry("Django", "# Django\n\nEdited.\n")
+        out = io.StringIO()
+        call_command("wiki_import", destination, "--workers", "2", stdout=out)
+        self.assertIn("Imported 2 entries", out.getvalue())
+        self.assertEqual(util.get_entry("Django"), "# Django\n\nA **framework**.\n")
+
+    def test_import_tarball(self):
+        """Entries of a tarball must be imported and invalid ones skipped"""
+        source = os.path.join(self.media_root, "dump.tar.gz")
+        with tarfile.open(source, "w:gz") as tar:
+            for name, data in [("dump/CSS.md", b"# CSS\r\n\r\nStyle.\r\n"), ("dump/.hidden.md", b""),
+                               ("dump/Latin1.md", "caf\xe9".encode("latin-1"))]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        out, err = io.StringIO(), io.StringIO()
+        call_command("wiki_import", source, stdout=out, stderr=err)
+        self.assertIn("Imported 1 entries (2 skipped)", out.getvalue())
+        self.assertEqual(util.list_entries(), ["CSS", "Python"])
+        self.assertEqual(util.get_entry("CSS"), "# CSS\n\nStyle.\n")
+
+
+class EntryStorageTestCase(EntriesTestCase):
+    """Define a test of the configured entry storage against the entries files storage"""
+
+    def test_same_behaviour_as_files(self):
+        """The entry storage must behave as the entries files storage"""
+        contents = {"Python": "# Python\n\n**Python** is a programming language.\n",
+                    "Caf\xe9": "# Caf\xe9\n\n- one\n- two", "Empty": ""}
+        for title, content in contents.items():
+            util.save_entry(title, content.replace("\n", "\r\n"))
+        for storage in ["encyclopedia.storage.FileEntryStorage", settings.WIKI_ENTRY_STORAGE]:
+            with self.settings(WIKI_ENTRY_STORAGE=storage):
+                if storage.endswith("FileEntryStorage"):
+                    for title, content in contents.items():
+                        util.save_entry(title, content)
+                self.assertEqual(util.list_entries(), sorted(contents))
+                self.assertEqual(util.find_entry("python"), "Python")
+                self.assertIsNone(util.get_entry("Missing"))
+                self.assertIsNone(util.entry_size("Missing"))
+                self.assertIsNone(util.entry_modified_time("Missing"))
+                for title, content in contents.items():
+                    self.assertEqual(util.get_entry(title), content)
+                    self.assertEqual(util.entry_size(title), len(content.encode()))
+                    self.assertEqual(list(util.iter_entry_lines(title)), content.split("\n"))
+                    self.assertLessEqual(util.entry_modified_time(title), util.entries_modified_time())
+                self.assertContains(self.client.get("/wiki/Python"), "<strong>Python</strong>")
+
+    def test_save_entries_in_one_write(self):
+        """A batch of entries must be written at once, each saved revision following the previous one"""
+        storage_class = type(util.get_entry_storage())
+        with patch.object(storage_class, "write_many", autospec=True,
+                          side_effect=storage_class.write_many) as write_many:
+            util.save_entries([("Python", "# Python\n\nOne.\n"), ("CSS", "# CSS\n"), ("Python", "# Python\n\nTwo.\n")])
+        self.assertEqual(write_many.call_count, 1)
+        self.assertEqual(util.get_entry("Python"), "# Python\n\nTwo.\n")
+        self.assertEqual([history.get_revision("Python", number) for number in [2, 3]],
+                         ["# Python\n\nOne.\n", "# Python\n\nTwo.\n"])
+        self.assertEqual(util.search_entries("css"), ["CSS"])
+
+
+@override_settings(WIKI_ENTRY_STORAGE="encyclopedia.pack.PackEntryStorage")
+class PackStorageTestCase(EntryStorageTestCase):
+
+    def test_appends_of_other_processes(self):
+        """Records appended by another storage instance must be read without reopening"""
+        other = PackEntryStorage()
+        self.assertEqual(other.titles(), ["Python"])
+        util.save_entry("Django", "# Django\n")
+        util.save_entry("Python", "# Python\n\nEdited.\n")
+        self.assertEqual(other.titles(), ["Django", "Python"])
+        self.assertEqual(other.read("Python"), "# Python\n\nEdited.\n")
+
+    def test_compaction(self):
+        """Compacting must keep the last content of each entry only, also for already mapped packs"""
+        other = PackEntryStorage()
+        for i in range(10):
+            util.save_entry("Python", f"# Python\n\nRevision {i}.\n")
+        util.save_entry("Django", "# Django\n")
+        self.assertEqual(other.read("Python"), "# Python\n\nRevision 9.\n")
+        path = os.path.join(self.media_root, "pack", "entries.pack")
+        size = os.path.getsize(path)
+
+        out = io.StringIO()
+        call_command("wiki_pack_compact", stdout=out)
+        self.assertIn("Compacted 2 entries", out.getvalue())
+        self.assertLess(os.path.getsize(path), size)
+        for storage in [util.get_entry_storage(), other]:
+            self.assertEqual(storage.titles(), ["Django", "Python"])
+            self.assertEqual(storage.read("Python"), "# Python\n\nRevision 9.\n")
+        util.save_entry("CSS", "# CSS\n")
+        self.assertEqual(other.read("CSS"), "# CSS\n")
+
+    def test_compaction_needs_pack_storage(self):
+        with self.settings(WIKI_ENTRY_STORAGE="encyclopedia.storage.FileEntryStorage"):
+            with self.assertRaises(CommandError):
+                call_command("wiki_pack_compact", stdout=io.StringIO())
+
+
+@override_settings(WIKI_ENTRY_STORAGE="encyclopedia.sqlite.SQLiteEntryStorage")
+class SQLiteStorageTestCase(EntryStorageTestCase):
+
+    def add_entries(self):
+        util.save_entry("Django", "# Django\n\nA web framework written in Python.\n")
+        util.save_entry('Quote "marks"', "# Quotes\n")
+
+    def test_search(self):
+        """Full-text matches must rank title matches first, followed by title substring matches"""
+        self.add_entries()
+        self.assertEqual(util.search_entries("python"), ["Python", "Django"])
+        self.assertEqual(util.search_entries("jang"), ["Django"])
+        self.assertEqual(util.search_entries("dj"), ["Django"])
+        self.assertEqual(util.search_entries('"marks"'), ['Quote "marks"'])
+        self.assertEqual(util.search_entries("nothing"), [])
+        response = self.client.post("/", {"q": "framework"})
+        self.assertEqual(response.context["entries"], ["Django"])
+
+    def test_search_follows_saved_entries(self):
+        self.add_entries()
+        util.save_entry("Django", "# Django\n\nEdited.\n")
+        self.assertEqual(util.search_entries("web"), [])
+        self.assertEqual(util.search_entries("edited"), ["Django"])
+
+    def test_random_entry(self):
+        self.add_entries()
+        titles = {util.random_entry() for i in range(50)}
+        self.assertEqual(titles, {"Django", "Python", 'Quote "marks"'})
+
+    def test_migrate_from_files(self):
+        """Entries of the entries folder must be copied to the database"""
+        self.add_entries()
+        with self.settings(WIKI_ENTRY_STORAGE="encyclopedia.storage.FileEntryStorage"):
+            for title in ["CSS", "HTML", "Git"]:
+                util.save_entry(title, f"# {title}\n")
+        out = io.StringIO()
+        call_command("wiki_migrate_storage", "encyclopedia.sqlite.SQLiteEntryStorage", "--batch-size", "2", stdout=out)
+        self.assertIn("Migrated 3 entries", out.getvalue())
+        self.assertEqual(util.list_entries(), ["CSS", "Django", "Git", "HTML", "Python", 'Quote "marks"'])
+        self.assertEqual(util.search_entries("git"), ["Git"])
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_benchmark_results_and_baseline(self):
+        """Benchmark must write its results as JSON, and fail on a regression over a baseline"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        results_file = os.path.join(directory, "results.json")
+        call_command("wiki_bench", "wiki", "--entries", "20", "--entry-size", "512", "--repeat", "1",
+                     "--json", results_file, stdout=io.StringIO())
+        with open(results_file) as f:
+            results = json.load(f)["results"]
+        self.assertEqual(set(results), {"markdown_to_html", "list_entries", "get_entry", "entry_view",
+                                        "search_view", "random_view", "suggest_view_p50", "suggest_view_p99"})
+
+        baseline_file = os.path.join(directory, "baseline.json")
+        with open(baseline_file, "w") as f:
+            json.dump({"results": {name: value / 100 for name, value in results.items()}}, f)
+        with self.assertRaises(CommandError):
+            call_command("wiki_bench", "wiki", "--entries", "20", "--entry-size", "512", "--repeat", "1",
+                         "--baseline", baseline_file, stdout=io.StringIO())
+
+    def test_storage_benchmark(self):
+        """Storage benchmark must time every entry storage at every corpus size"""
+        out = io.StringIO()
+        call_command("wiki_bench", "storage", "--storage-counts", "10", "20", "--repeat", "1", stdout=out)
+        for storage in ["file", "pack", "sqlite"]:
+            self.assertIn(f"search_entries {storage} 20", out.getvalue())
+
+    def test_load_benchmark(self):
+        """Load test must serve every request from WSGI and ASGI workers, then route the sync views again"""
+        out = io.StringIO()
+        call_command("wiki_bench", "load", "--entries", "5", "--clients", "4", "--client-requests", "2",
+                     "--read-delay", "0", "--repeat", "1", stdout=out)
+        for name in ["load_wsgi", "load_asgi_sync_views", "load_asgi_async_views"]:
+            self.assertIn(name, out.getvalue())
+        self.assertEqual(Client().get("/random").resolver_match.func, views.random_entry)
+
+
+class ConditionalGetTestCase(EntriesTestCase):
+
+    def test_entry_not_modified(self):
+        """Entry page must not be rendered again for a client having the current version"""
+        response = self.client.get("/wiki/Python")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        with patch.object(util, "get_entry") as get_entry:
+            response = self.client.get("/wiki/Python", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get("/wiki/Python", HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+            get_entry.assert_not_called()
+
+    def test_entry_modified(self):
+        """Entry page must be rendered again once the entry changed"""
+        etag = self.client.get("/wiki/Python")["ETag"]
+        util.save_entry("Python", "# Python\n\nEdited.\n")
+        response = self.client.get("/wiki/Python", HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Edited.")
+
+    def test_index_not_modified(self):
+        """Index page must not be rendered again until an entry is added"""
+        etag = self.client.get("/")["ETag"]
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        util.save_entry("Django", "# Django\n")
+        self.assertContains(self.client.get("/", HTTP_IF_NONE_MATCH=etag), "Django")
+
+    def test_missing_entry(self):
+        response = self.client.get("/wiki/Missing")
+        self.assertContains(response, "Page not found")
+        self.assertFalse(response.has_header("ETag"))
+
+
+class StaticBuildTestCase(EntriesTestCase):
+
+    def build(self):
+        out = io.StringIO()
+        call_command("wiki_build", self.output, "--workers", "2", stdout=out)
+        return out.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        util.save_entry("Django", "# Django\n")
+        self.output = os.path.join(self.media_root, "build")
+
+    def test_build(self):
+        """Index and entry pages must be rendered as static files"""
+        self.assertIn("Rendered 2 of 2 entries", self.build())
+        with open(os.path.join(self.output, "wiki", "Python.html")) as f:
+            self.assertIn("<strong>Python</strong>", f.read())
+        with open(os.path.join(self.output, "index.html")) as f:
+            self.assertIn('href="/wiki/Django"', f.read())
+
+    def test_build_readable(self):
+        """Built pages must be readable by everyone, e.g. a web server serving them"""
+        self.build()
+        for path in [os.path.join(self.output, "index.html"), os.path.join(self.output, "wiki", "Python.html")]:
+            self.assertEqual(os.stat(path).st_mode & 0o444, 0o444, path)
+
+    def test_incremental_build(self):
+        """Only changed entries must be rendered again, removed entries must be removed"""
+        self.build()
+        self.assertIn("Rendered 0 of 2 entries", self.build())
+        util.save_entry("Python", "# Python\n\nEdited.\n")
+        os.remove(os.path.join(self.media_root, "entries", "Django.md"))
+        self.assertIn("Rendered 1 of 1 entries (1 removed)", self.build())
+        self.assertEqual(os.listdir(os.path.join(self.output, "wiki")), ["Python.html"])
+
+    def test_build_follows_backlinks(self):
+        """Entry pages must be rendered again when their backlinks change"""
+        self.build()
+        util.save_entry("Django", "# Django\n\n[Python](/wiki/Python)\n")
+        self.assertIn("Rendered 2 of 2 entries", self.build())
+        with open(os.path.join(self.output, "wiki", "Python.html")) as f:
+            self.assertIn("What links here", f.read())
+
+    def test_search_from_static_page(self):
+        """Search form of static pages must work without CSRF token"""
+        client = Client(enforce_csrf_checks=True)
+        self.assertEqual(client.post("/", {"q": "Pyth"}).status_code, 200)
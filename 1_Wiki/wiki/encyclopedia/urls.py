@@ -1,11 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+if settings.WIKI_ASYNC_VIEWS:
+    # the views reading entries run on a thread pool, for ASGI servers
+    index, entry, edit, random_entry = views.async_index, views.async_entry, views.async_edit, views.async_random_entry
+else:
+    index, entry, edit, random_entry = views.index, views.entry, views.edit, views.random_entry
+
 urlpatterns = [
-    path("", views.index, name="index"),
-    path("wiki/<str:title>", views.entry, name="entry"),
+    path("", index, name="index"),
+    path("wiki/<str:title>", entry, name="entry"),
     path("create", views.create, name="create"),
-    path("edit/<str:title>", views.edit, name="edit"),
-    path("random", views.random_entry, name="random")
+    path("edit/<str:title>", edit, name="edit"),
+    path("history/<str:title>", views.entry_history, name="history"),
+    path("history/<str:title>/<int:number>", views.revision_diff, name="diff"),
+    path("orphans", views.orphans, name="orphans"),
+    path("random", random_entry, name="random"),
+    path("api/suggest", views.suggest, name="suggest"),
+    path("api/stats", views.stats, name="stats")
 ]
@@ -1,28 +1,278 @@
+import bisect
+import hashlib
+import random
 import re
+import threading
+from collections import Counter
+from datetime import datetime
 
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.html import escape
+
+from . import fuzzy, history, links, markdown, search
+from .cache import BlockCache, NegativeCache
+from .storage import atomic_write, get_entry_storage
+
+# Hits and misses of the rendered entries cache, and of the rendered blocks cache,
+# and renderings given up for taking too long
+render_cache_stats = Counter(hits=0, misses=0, block_hits=0, block_misses=0, timeouts=0)
+
+# Rendered blocks of the entries
+block_cache = BlockCache()
+
+# Titles of the entries recently found missing, and lookups of entries by title:
+# lookups of missing entries answered by the storage (misses) or by the cache (cached_misses)
+missing_entries = NegativeCache()
+entry_lookup_stats = Counter(lookups=0, misses=0, cached_misses=0)
+
+# Titles become file names: no path separators, no hidden files
+TITLE = re.compile(r"[^./\\\x00][^/\\\x00]*")
+
+# Serializes entry writes, so that history deltas apply to the right revision
+_save_lock = threading.Lock()
+
+
+class TitleIndex:
+    """
+    Process-level index of entry titles. It is rebuilt only when the version of
+    the entry storage changes (entry added or removed) or when an entry is saved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (entry storage version, sorted titles, lowercase title -> title)
+        self._snapshot = (None, (), {})
+        # (snapshot, sorted lowercase titles), built on first completion
+        self._completion_keys = (None, [])
+
+    def _current(self):
+        storage = get_entry_storage()
+        version = storage.version()
+        snapshot = self._snapshot
+        if snapshot[0] != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot[0] != version:
+                    titles = tuple(storage.titles())
+                    snapshot = (version, titles, {title.lower(): title for title in titles})
+                    self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        self._snapshot = (None, (), {})
+
+    def titles(self):
+        """
+        Returns the sorted tuple of all titles.
+        """
+        return self._current()[1]
+
+    def find(self, title):
+        """
+        Returns the title of the entry matching given title regardless of case, or None.
+        """
+        return self._current()[2].get(title.lower())
+
+    def complete(self, prefix, limit=10):
+        """
+        Returns up to limit titles starting with given prefix regardless of case,
+        in lowercase order, found by bisection in the sorted lowercase titles.
+        """
+        snapshot = self._current()
+        completion_keys = self._completion_keys
+        if completion_keys[0] is not snapshot:
+            completion_keys = (snapshot, sorted(snapshot[2]))
+            self._completion_keys = completion_keys
+        keys = completion_keys[1]
+        prefix = prefix.lower()
+        start = bisect.bisect_left(keys, prefix)
+        titles = []
+        for key in keys[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            titles.append(snapshot[2][key])
+        return titles
+
+    def random(self):
+        """
+        Returns a random title, or None if there are no entries.
+        """
+        titles = self._current()[1]
+        return random.choice(titles) if titles else None
+
+
+title_index = TitleIndex()
 
 
 def list_entries():
     """
     Returns a list of all names of encyclopedia entries.
     """
-    _, filenames = default_storage.listdir("entries")
-    return list(sorted(re.sub(r"\.md$", "", filename)
-                for filename in filenames if filename.endswith(".md")))
+    return list(title_index.titles())
+
+
+def find_entry(title):
+    """
+    Returns the name of the entry matching given title regardless of case.
+    If no such entry exists, the function returns None.
+    """
+    return title_index.find(title)
+
+
+def random_entry():
+    """
+    Returns the name of a random entry, or None if there are no entries.
+    """
+    storage = get_entry_storage()
+    if hasattr(storage, "random"):
+        return storage.random()
+    return title_index.random()
+
+
+def complete_entries(prefix, limit=10):
+    """
+    Returns the names of up to limit entries whose title starts with
+    the given prefix regardless of case.
+    """
+    if not prefix:
+        return []
+    return title_index.complete(prefix, limit)
+
+
+def search_entries(query):
+    """
+    Returns the names of entries whose title or content matches the query,
+    best matches first, followed by entries having the query as title substring.
+    """
+    storage = get_entry_storage()
+    if hasattr(storage, "search"):
+        # the storage indexes entries itself
+        entries = storage.search(query)
+        matches = storage.titles_containing(query)
+    else:
+        entries = search.search_index.search(query)
+        fuzzy.title_trigrams.sync(title_index.titles())
+        matches = fuzzy.title_trigrams.containing(query)
+    found = set(entries)
+    entries += [entry for entry in matches if entry not in found]
+    return entries
+
+
+def suggest_entries(query, limit=5):
+    """
+    Returns the names of entries whose title is close to the query,
+    even if misspelled, closest first.
+    """
+    fuzzy.title_trigrams.sync(title_index.titles())
+    return fuzzy.title_trigrams.search(query, limit=limit)
+
+
+def entry_backlinks(title):
+    """
+    Returns the names of the other entries linking to an entry, sorted.
+    """
+    return links.link_graph.backlinks(title)
+
+
+def backlinks_modified_time(title):
+    """
+    Returns the last datetime an entry linking to given entry was added or
+    removed, or None if there never was any.
+    """
+    timestamp = links.link_graph.backlinks_changed(title)
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else None
+
+
+def orphan_entries():
+    """
+    Returns the names of the entries no other entry links to, sorted.
+    """
+    return links.link_graph.orphans()
+
+
+def valid_title(title):
+    """
+    Returns whether a title can be the title of an entry.
+    """
+    return TITLE.fullmatch(title) is not None
 
 
 def save_entry(title, content):
     """
     Saves an encyclopedia entry, given its title and Markdown
     content. If an existing entry with the same title already exists,
-    it is replaced.
+    it is replaced, atomically, and the new content is added to the
+    entry history.
+    """
+    save_entries([(title, content)])
+
+
+def save_entries(entries):
+    """
+    Saves several encyclopedia entries, given an iterable of (title, content)
+    pairs, written by a single write_many of the entry storage and updating
+    the title index once for the whole batch. Raises ValueError,
+    saving none of the entries, if a title is not valid.
     """
-    filename = f"entries/{title}.md"
-    if default_storage.exists(filename):
-        default_storage.delete(filename)
-    default_storage.save(filename, ContentFile(content))
+    # browsers submit textarea content with CRLF line breaks
+    entries = [(title, content.replace("\r\n", "\n")) for title, content in entries]
+    for title, content in entries:
+        if not valid_title(title):
+            raise ValueError(f"Invalid entry title: {title!r}")
+    storage = get_entry_storage()
+    changes = []
+    with _save_lock:
+        # latest content of each title, the batch saving some titles more than once
+        contents = {}
+        for title, content in entries:
+            if title not in contents:
+                contents[title] = storage.read(title)
+        # a single write of the whole batch (one transaction or append for the storages supporting it)
+        storage.write_many(entries)
+        for title, content in entries:
+            old_content = contents[title]
+            contents[title] = content
+            missing_entries.discard(title)
+            history.add_revision(title, old_content, content)
+            changes.append((title, old_content, content))
+    for title, old_content, content in changes:
+        if old_content is not None:
+            # drop the rendering of the replaced content
+            caches["wiki"].delete(html_cache_key(old_content))
+        if not hasattr(storage, "search"):
+            search.search_index.update(title, old_content, content)
+        links.link_graph.update(title, content)
+    title_index.invalidate()
+
+
+def _lookup(title, function):
+    """
+    Returns function(title), a storage lookup returning None for missing entries,
+    unless the entry was recently found missing.
+    """
+    entry_lookup_stats["lookups"] += 1
+    if title in missing_entries:
+        entry_lookup_stats["cached_misses"] += 1
+        return None
+    value = function(title)
+    if value is None:
+        entry_lookup_stats["misses"] += 1
+        missing_entries.add(title)
+    return value
+
+
+def entry_lookup_rates():
+    """
+    Returns the rate of lookups of missing entries, and the rate of those
+    answered without reaching the storage.
+    """
+    missing = entry_lookup_stats["misses"] + entry_lookup_stats["cached_misses"]
+    return {
+        "miss_rate": missing / entry_lookup_stats["lookups"] if entry_lookup_stats["lookups"] else 0.0,
+        "cached_miss_rate": entry_lookup_stats["cached_misses"] / missing if missing else 0.0,
+    }
 
 
 def get_entry(title):
@@ -30,45 +280,102 @@ def get_entry(title):
     Retrieves an encyclopedia entry by its title. If no such
     entry exists, the function returns None.
     """
-    try:
-        f = default_storage.open(f"entries/{title}.md", "r")
-        return f.read()
-    except FileNotFoundError:
-        return None
+    return _lookup(title, get_entry_storage().read)
+
+
+def entry_size(title):
+    """
+    Returns the size in bytes of an encyclopedia entry, or None if no
+    such entry exists.
+    """
+    return _lookup(title, get_entry_storage().size)
+
+
+def entry_modified_time(title):
+    """
+    Returns the last modification datetime of an encyclopedia entry,
+    or None if no such entry exists.
+    """
+    return _lookup(title, get_entry_storage().entry_modified_time)
+
+
+def entries_modified_time():
+    """
+    Returns the last datetime an entry was added or removed.
+    """
+    return get_entry_storage().modified_time()
+
+
+def iter_entry_lines(title):
+    """
+    Reads an encyclopedia entry line by line, yielding its lines without
+    line breaks (like str.split("\n") on the whole content).
+    """
+    return get_entry_storage().iter_lines(title)
 
 
 def markdown_to_html(content):
     """
     Converts content string from Markdown to HTML
     """
-    # Headings (from 1 to 6):
-    # content = re.sub(r'(^|\n)#{2} (.*)\n', r'\1<h2>\2</h2>\n', content)
-    for i in range(1, 7):
-        pattern = '(^|\n)#{' + str(i) + '} (.+)\n'
-        repl = '\\1<h' + str(i) + '>\\2</h' + str(i) + '>\n'
-        content = re.sub(pattern, repl, content)
+    return markdown.render(content)
 
-    # Bold
-    content = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', content)
 
-    # Italic (needs previous bold substitution)
-    content = re.sub(r'\*([^ ][^*]+)\*', r'<em>\1</em>', content)
+def plain_text_html(content):
+    """
+    Returns the HTML showing content string as is.
+    """
+    return f"<pre>{escape(content)}</pre>"
 
-    # Code
-    content = re.sub(r'`([^`]+)`', r'<code>\1</code>', content)
 
-    # Unordered lists
-    content = re.sub(r'\n(([-|*] .*\n)+)\n', r'\n<ul>\n\1</ul>\n\n', content)
-    content = re.sub(r'\n[-|*] (.*)', r'\n<li>\1</li>', content)
+def html_cache_key(content):
+    """
+    Returns the rendered entries cache key of a Markdown content.
+    Rendered entries are cached as (HTML, headings) pairs.
+    """
+    return "html:" + hashlib.sha256(content.encode()).hexdigest()
 
-    # Ordered lists
-    content = re.sub(r'\n((\d+\. .*\n)+)\n', r'\n<ol>\n\1</ol>\n', content)
-    content = re.sub(r'\n\d+\. (.*)', r'\n<li>\1</li>', content)
 
-    # Links
-    content = re.sub(r'\[([^]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', content)
+def cached_render_block(block):
+    """
+    Returns the HTML of a Markdown block, reusing the previous rendering of the
+    same block when it is still cached: after an edit, rendering an entry again
+    only converts the blocks that changed.
+    """
+    if block.kind == "blank":
+        return markdown.render_block(block)
+    html = block_cache.get(block)
+    if html is None:
+        render_cache_stats["block_misses"] += 1
+        html = markdown.render_block(block)
+        block_cache.set(block, html)
+    else:
+        render_cache_stats["block_hits"] += 1
+    return html
 
-    # Paragraphs
-    content = re.sub(r'^\s(.+)\s$', r'\n<p>\1</p>\n', content, flags=re.MULTILINE)
 
-    return content
+def cached_render_entry(content):
+    """
+    Converts content string from Markdown to HTML with heading anchors, reusing
+    the previous rendering of the same content, or of its blocks, when still
+    cached. Returns the HTML and the list of headings (table of contents).
+    If rendering takes more than WIKI_RENDER_TIMEOUT seconds, the content
+    is shown as plain text.
+    """
+    key = html_cache_key(content)
+    rendered = caches["wiki"].get(key)
+    if rendered is None:
+        render_cache_stats["misses"] += 1
+        headings = []
+        try:
+            html = markdown.render(content, render_block=cached_render_block, timeout=settings.WIKI_RENDER_TIMEOUT,
+                                   headings=headings)
+        except markdown.RenderTimeout:
+            # show the source instead, and cache it so that later views don't try again
+            render_cache_stats["timeouts"] += 1
+            html, headings = plain_text_html(content), []
+        rendered = (html, headings)
+        caches["wiki"].set(key, rendered)
+    else:
+        render_cache_stats["hits"] += 1
+    return rendered
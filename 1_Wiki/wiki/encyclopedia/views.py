@@ -1,25 +1,83 @@
-import random
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 # from markdown2 import Markdown
 
-from . import util
+from . import history, markdown, util
 
+# Placeholder of the content of streamed entry pages
+STREAM_MARKER = "<!-- entry content -->"
 
+# Entry pages with fewer headings get no table of contents
+TOC_MIN_HEADINGS = 2
+
+
+def table_of_contents(headings):
+    """
+    Returns the headings to list in the table of contents of an entry page.
+    """
+    return headings if len(headings) >= TOC_MIN_HEADINGS else []
+
+
+# Conditional GET: pages are only rendered again if their entries changed.
+# Clients have to revalidate them on each request (no-cache).
+
+def index_last_modified(request):
+    return util.entries_modified_time()
+
+
+def index_etag(request):
+    return f"{util.entries_modified_time().timestamp()}-{len(util.title_index.titles())}"
+
+
+# Entry pages also change when their backlinks do
+
+def entry_last_modified(request, title):
+    modified = util.entry_modified_time(title)
+    backlinks_modified = util.backlinks_modified_time(title)
+    if modified is not None and backlinks_modified is not None:
+        return max(modified, backlinks_modified)
+    return modified
+
+
+def entry_etag(request, title):
+    modified = util.entry_modified_time(title)
+    if modified is not None:
+        backlinks_modified = util.backlinks_modified_time(title)
+        backlinks_timestamp = backlinks_modified.timestamp() if backlinks_modified is not None else 0
+        return f"{modified.timestamp()}-{util.entry_size(title)}-{backlinks_timestamp}"
+
+
+# searching changes nothing: it needs no CSRF token, so it also works from statically built pages
+@csrf_exempt
+@cache_control(no_cache=True)
+@condition(etag_func=index_etag, last_modified_func=index_last_modified)
 def index(request):
     if request.method == "POST":
         # coming from sidebar search query
         title = request.POST["q"]
-        # if query matches an entry, redirect to that entry page
-        if util.get_entry(title):
-            return HttpResponseRedirect(reverse("entry", kwargs={"title": title}))
+        # if query matches an entry (regardless of case), redirect to that entry page
+        entry_title = util.find_entry(title)
+        if entry_title:
+            return HttpResponseRedirect(reverse("entry", kwargs={"title": entry_title}))
 
-        # list entries that have the query as substring
+        # list entries matching the query in their title or content,
+        # and suggest entries with a close title in case of a typo
+        entries = util.search_entries(title)
         return render(request, "encyclopedia/index.html", {
             "query": True,
-            "entries": [entry for entry in util.list_entries() if title.lower() in entry.lower()]
+            "entries": entries,
+            "suggestions": [entry for entry in util.suggest_entries(title) if entry not in entries]
         })
 
     # Request.GET: list all entries
@@ -29,7 +87,25 @@ def index(request):
     })
 
 
+# titles completing the search box query, as it is typed: browsers may reuse
+# responses for a while, then revalidate them like the index page
+@cache_control(max_age=settings.WIKI_SUGGEST_MAX_AGE)
+@condition(etag_func=index_etag, last_modified_func=index_last_modified)
+def suggest(request):
+    query = request.GET.get("q", "")
+    return JsonResponse({
+        "query": query,
+        "titles": util.complete_entries(query, settings.WIKI_SUGGEST_LIMIT)
+    })
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=entry_etag, last_modified_func=entry_last_modified)
 def entry(request, title):
+    size = util.entry_size(title)
+    if size is not None and size > settings.WIKI_STREAMING_THRESHOLD:
+        return stream_entry(request, title)
+
     content = util.get_entry(title)
     if not content:
         return render(request, "encyclopedia/notfound.html", {
@@ -38,13 +114,37 @@ def entry(request, title):
     else:
         # markdowner = Markdown()
         # content = markdowner.convert(content)
-        content = util.markdown_to_html(content)
+        content, headings = util.cached_render_entry(content)
         return render(request, "encyclopedia/entry.html", {
             "title": title,
-            "content": content
+            "content": content,
+            "toc": table_of_contents(headings),
+            "backlinks": util.entry_backlinks(title)
         })
 
 
+def stream_entry(request, title):
+    """
+    Renders a large entry progressively: its Markdown is read and converted
+    block by block and sent within the entry page as soon as it is ready.
+    """
+    page = render_to_string("encyclopedia/entry.html", {
+        "title": title,
+        "content": STREAM_MARKER,
+        "backlinks": util.entry_backlinks(title)
+    }, request)
+    head, tail = page.split(STREAM_MARKER)
+
+    def stream():
+        yield head
+        # headings get anchors, but the table of contents would only be known at the end
+        yield from markdown.render_chunks(util.iter_entry_lines(title), render_block=util.cached_render_block,
+                                          headings=[])
+        yield tail
+
+    return StreamingHttpResponse(stream())
+
+
 def create(request):
     if request.method == "POST":
         title = request.POST["title"]
@@ -52,8 +152,13 @@ def create(request):
         error_message = ""
         if not (title and content):
             error_message = "Please enter a title and a content"
-        if util.get_entry(title):
-            error_message = "This page already exists"
+        elif not util.valid_title(title):
+            error_message = "Titles can't contain slashes nor start with a dot"
+        else:
+            # the page may have been created by another process since it was found missing
+            util.missing_entries.discard(title)
+            if util.get_entry(title):
+                error_message = "This page already exists"
         if error_message:
             # present error message and keep form content
             return render(request, "encyclopedia/create.html", {
@@ -72,6 +177,13 @@ def create(request):
 
 def edit(request, title):
     if request.method == "POST":
+        if not util.valid_title(title):
+            # present error message and keep form content
+            return render(request, "encyclopedia/edit.html", {
+                "error_message": "Titles can't contain slashes nor start with a dot",
+                "title": title,
+                "content": request.POST["content"]
+            })
         util.save_entry(title, request.POST["content"])
         return HttpResponseRedirect(reverse("entry", kwargs={"title": title}))
 
@@ -88,9 +200,99 @@ def edit(request, title):
         })
 
 
+def entry_history(request, title):
+    revisions = history.list_revisions(title)
+    if not revisions:
+        content = util.get_entry(title)
+        if content is None:
+            return render(request, "encyclopedia/notfound.html", {
+                "title": title,
+            })
+        # entries never saved through the wiki have their current content as only revision,
+        # recorded when they are first saved
+        revisions = [history.initial_revision(content, util.entry_modified_time(title))]
+    return render(request, "encyclopedia/history.html", {
+        "title": title,
+        "revisions": revisions[::-1]
+    })
+
+
+def revision_diff(request, title, number):
+    diff = history.diff_revision(title, number)
+    if diff is None and number == 1 and not history.list_revisions(title):
+        content = util.get_entry(title)
+        if content is not None:
+            diff = history.diff_initial_revision(title, content)
+    if diff is None:
+        return render(request, "encyclopedia/notfound.html", {
+            "title": f"{title} (revision {number})",
+        })
+    return render(request, "encyclopedia/diff.html", {
+        "title": title,
+        "number": number,
+        "diff": diff
+    })
+
+
+def orphans(request):
+    return render(request, "encyclopedia/orphans.html", {
+        "entries": util.orphan_entries()
+    })
+
+
+@cache_control(no_cache=True)
+def stats(request):
+    """
+    Returns the caches and entry lookups statistics of the process, for monitoring.
+    """
+    return JsonResponse({
+        "render_cache": util.render_cache_stats,
+        "entry_lookups": {**util.entry_lookup_stats, **util.entry_lookup_rates()},
+        "missing_entries_cached": len(util.missing_entries),
+    })
+
+
 def random_entry(request):
-    entries = util.list_entries()
-    if entries:
-        return HttpResponseRedirect(reverse("entry", kwargs={"title": random.choice(entries)}))
+    title = util.random_entry()
+    if title:
+        return HttpResponseRedirect(reverse("entry", kwargs={"title": title}))
     else:
         return render(request, "encyclopedia/notfound.html")
+
+
+# Async variants of the views reading entries, served to ASGI servers (WIKI_ASYNC_VIEWS).
+# Django runs sync views one at a time on a single thread under ASGI: these run them
+# on a bounded pool of threads instead, so that a worker keeps serving readers while
+# entries are read and rendered.
+
+view_threads = ThreadPoolExecutor(max_workers=settings.WIKI_ASYNC_THREADS, thread_name_prefix="wiki-view")
+
+
+def offload(view):
+    """
+    Returns an async view running the given view on the view threads.
+    """
+    def run(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.streaming:
+            # Django would iterate the content on the event loop: render it all in the thread instead
+            content = b"".join(response.streaming_content)
+            response.close()
+            streamed, response = response, HttpResponse(content, status=response.status_code)
+            for header, value in streamed.items():
+                response[header] = value
+        return response
+
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            view_threads, functools.partial(context.run, run, request, *args, **kwargs))
+
+    return async_view
+
+
+async_index = offload(index)
+async_entry = offload(entry)
+async_edit = offload(edit)
+async_random_entry = offload(random_entry)
@@ -119,3 +119,54 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered entries, keyed by a hash of their Markdown source
+    'wiki': {
+        'BACKEND': 'encyclopedia.cache.LRUCache',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_BYTES': 64 * 1024 * 1024,
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
+# Encyclopedia
+
+# Served by an ASGI server (wiki.asgi), the views reading entries can run on a pool of
+# this number of threads, so that a worker serves many readers while entries are read
+WIKI_ASYNC_VIEWS = False
+WIKI_ASYNC_THREADS = 32
+
+# Entries bigger than this (in bytes) are rendered progressively
+WIKI_STREAMING_THRESHOLD = 1024 * 1024
+
+# Entries taking longer than this (in seconds) to render are shown as plain text
+WIKI_RENDER_TIMEOUT = 2.0
+
+# Missing titles are remembered for this time (in seconds), up to this number of titles,
+# so that requests for missing entries don't reach the entries storage
+WIKI_MISSING_CACHE_TTL = 10
+WIKI_MISSING_CACHE_SIZE = 10000
+
+# Number of titles suggested as the search query is typed, and time (in seconds) browsers may reuse suggestions
+WIKI_SUGGEST_LIMIT = 10
+WIKI_SUGGEST_MAX_AGE = 60
+
+# Memory budget (in bytes) of the rendered blocks cache, which makes rendering an edited entry
+# convert only its changed blocks
+WIKI_BLOCK_CACHE_BYTES = 32 * 1024 * 1024
+
+# Entries storage: one Markdown file per entry in entries/ (encyclopedia.storage.FileEntryStorage),
+# a single memory-mapped pack file in pack/ (encyclopedia.pack.PackEntryStorage),
+# or a SQLite database with full-text search, entries.sqlite3 (encyclopedia.sqlite.SQLiteEntryStorage)
+WIKI_ENTRY_STORAGE = 'encyclopedia.storage.FileEntryStorage'
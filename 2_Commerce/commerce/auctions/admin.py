@@ -3,8 +3,16 @@ from django.contrib import admin
 from .models import User, Category, Listing, Bid, Comment, Watchlist
 
 
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ("name", "active_listings_count")
+    # updated along with the listings
+    readonly_fields = ("active_listings_count",)
+
+
 class ListingAdmin(admin.ModelAdmin):
     list_display = ("title", "user", "is_active", "creation_date")
+    # written along with the bids
+    readonly_fields = ("current_price", "bid_count", "last_bid")
 
 
 class BidAdmin(admin.ModelAdmin):
@@ -17,7 +25,7 @@ class CommentAdmin(admin.ModelAdmin):
 
 
 admin.site.register(User)
-admin.site.register(Category)
+admin.site.register(Category, CategoryAdmin)
 admin.site.register(Listing, ListingAdmin)
 admin.site.register(Bid, BidAdmin)
 admin.site.register(Comment, CommentAdmin)
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from auctions.models import Bid, Listing
+
+
+class Command(BaseCommand):
+    help = ("Computes the bids summary of the listings (current price, bid count and last bid) from their bids, "
+            "after adding the summary columns or deleting bids")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Listings updated in a single transaction")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        bids = Bid.objects.filter(listing=OuterRef("pk"))
+        # legacy bids may have been placed below a higher bid: the current bid is the highest one,
+        # not the latest one
+        highest_bids = bids.order_by("-amount_dollars", "-pk")
+        bid_summaries = bids.order_by().values("listing")
+        highest_amounts = bid_summaries.annotate(amount=Max("amount_dollars")).values("amount")
+        bid_counts = bid_summaries.annotate(count=Count("pk")).values("count")
+        ids = list(Listing.objects.order_by("pk").values_list("pk", flat=True))
+        updated = 0
+        for i in range(0, len(ids), options["batch_size"]):
+            batch = ids[i:i + options["batch_size"]]
+            with transaction.atomic():
+                updated += Listing.objects.filter(pk__gte=batch[0], pk__lte=batch[-1]).update(
+                    current_price=Coalesce(Subquery(highest_amounts), F("starting_bid_dollars")),
+                    bid_count=Coalesce(Subquery(bid_counts), 0),
+                    last_bid=Subquery(highest_bids.values("pk")[:1]))
+        self.stdout.write(f"Backfilled the bids summary of {updated} listings in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from auctions.models import Bid, BidRejected, Listing, User
+from auctions.pagination import LISTINGS_ORDER, encode_cursor, listings_page
+
+BENCHMARKS = ["bids", "pages"]
+
+
+def timeit(function, repeat=5):
+    """
+    Returns the best wall clock time of `repeat` calls, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the auctions hot paths against the configured database, "
+            "on data created for the benchmark and deleted afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument("benchmarks", nargs="*", choices=BENCHMARKS,
+                            help="Benchmarks to run (all by default)")
+        parser.add_argument("--bidders", type=int, default=200, help="Concurrent bidders on the hot listing")
+        parser.add_argument("--bids", type=int, default=5, help="Bids placed by each bidder")
+        parser.add_argument("--listings", type=int, default=100000, help="Active listings paginated")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per measure (best is kept)")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+
+    def handle(self, *args, **options):
+        # names of the data created by this run
+        self.prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        for benchmark in options["benchmarks"] or BENCHMARKS:
+            getattr(self, f"bench_{benchmark}")(options)
+
+    def bench_bids(self, options):
+        """
+        Has concurrent bidders outbid each other on a single listing, each bidding a few dollars over
+        the price it last read. Fails unless bids were placed at strictly increasing prices and the
+        listing summary matches its bids.
+        """
+        seller = User.objects.create(username=f"{self.prefix}-seller")
+        bidders = User.objects.bulk_create(User(username=f"{self.prefix}-bidder-{i}")
+                                           for i in range(options["bidders"]))
+        # bulk_create sets primary keys on some databases only
+        bidders = list(User.objects.filter(username__startswith=f"{self.prefix}-bidder-"))
+        listing = Listing.objects.create(user=seller, title=f"{self.prefix} hot listing",
+                                         starting_bid_dollars=Decimal("1.00"))
+        start_line = threading.Barrier(len(bidders))
+        placed = []
+        rejected = []
+        errors = []
+
+        def bid(user, seed):
+            rng = random.Random(seed)
+            try:
+                start_line.wait()
+                for _ in range(options["bids"]):
+                    seen = Listing.objects.get(pk=listing.pk)
+                    try:
+                        Bid(user=user, listing=seen,
+                            amount_dollars=seen.current_price + rng.randint(1, 5)).save()
+                        placed.append(user)
+                    except BidRejected:
+                        # outbid meanwhile
+                        rejected.append(user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bid, args=(user, options["seed"] + i)) for i, user in enumerate(bidders)]
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if errors:
+                raise CommandError(f"{len(errors)} bidders failed, first with: {errors[0]!r}")
+
+            listing.refresh_from_db()
+            bids = list(listing.bids.order_by("pk"))
+            prices = [bid.amount_dollars for bid in bids]
+            if any(previous >= price for previous, price in zip(prices, prices[1:])):
+                raise CommandError("Bids were placed at prices not strictly increasing")
+            if (len(bids), listing.bid_count, listing.last_bid) != (len(placed), len(placed), bids[-1] if bids else None):
+                raise CommandError("Listing bids summary does not match its bids")
+            if listing.current_price != (prices[-1] if prices else listing.starting_bid_dollars):
+                raise CommandError("Listing price is not its highest bid")
+        finally:
+            listing.delete()
+            User.objects.filter(username__startswith=self.prefix).delete()
+
+        attempts = len(placed) + len(rejected)
+        self.stdout.write(f"{len(bidders)} bidders, {attempts} bids in {elapsed:.2f} s "
+                          f"({attempts / elapsed:.0f} bids/s): {len(placed)} placed at strictly increasing prices "
+                          f"({len(placed) / elapsed:.0f} bids/s), {len(rejected)} outbid")
+
+    def bench_pages(self, options, batch_size=10000):
+        """
+        Times the first and a deep page of the active listings, selected by cursor
+        and, for comparison, by offset.
+        """
+        seller = User.objects.create(username=f"{self.prefix}-seller")
+        try:
+            start = time.perf_counter()
+            for i in range(0, options["listings"], batch_size):
+                Listing.objects.bulk_create(
+                    Listing(user=seller, title=f"{self.prefix} listing {j}", current_price=1)
+                    for j in range(i, min(i + batch_size, options["listings"])))
+            self.stdout.write(f"{options['listings']} listings created in {time.perf_counter() - start:.2f} s")
+
+            active = Listing.objects.filter(is_active=True)
+            page_size = settings.AUCTIONS_PAGE_SIZE
+            depth = active.count() * 9 // 10
+            cursor = encode_cursor(active.order_by(*LISTINGS_ORDER)[depth - 1])
+            measures = {
+                "first page": lambda: listings_page(active),
+                f"page at {depth} by cursor": lambda: listings_page(active, cursor),
+                f"page at {depth} by offset": lambda: list(active.order_by(*LISTINGS_ORDER)[depth:depth + page_size]),
+            }
+            for name, function in measures.items():
+                self.stdout.write(f"{name:>36}: {timeit(function, options['repeat']) * 1000:10.3f} ms")
+        finally:
+            # the listings have no bids, comments nor watchers: deleted without collecting them
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {Listing._meta.db_table} WHERE user_id = %s", [seller.pk])
+            seller.delete()
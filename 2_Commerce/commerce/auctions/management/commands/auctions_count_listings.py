@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from auctions.models import Category
+
+
+class Command(BaseCommand):
+    help = ("Counts the active listings of each category again, after adding the counters "
+            "or changing listings without saving them one by one")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        # a single grouped query counting the listings of all categories
+        categories = list(Category.objects.annotate(counted=Count("listings", filter=Q(listings__is_active=True))))
+        for category in categories:
+            category.active_listings_count = category.counted
+        Category.objects.bulk_update(categories, ["active_listings_count"])
+        self.stdout.write(f"Counted the active listings of {len(categories)} categories "
+                          f"in {time.perf_counter() - start:.2f} s")
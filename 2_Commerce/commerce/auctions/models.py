@@ -1,8 +1,18 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.forms import ModelForm, Select, TextInput, Textarea, NumberInput
 
 
+class BidRejected(Exception):
+    """
+    Raised when saving a bid not greater than the current price of its listing, or on a closed listing.
+    """
+
+
 class User(AbstractUser):
     pass
 
@@ -10,12 +20,20 @@ class User(AbstractUser):
 class Category(models.Model):
     name = models.CharField(max_length=64)
 
+    # counter of the active listings in the category, updated as listings are created, closed or moved
+    # (see Listing.save), so that the categories page doesn't count listings
+    active_listings_count = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return f"{self.name}"
 
-    @property
-    def active_listings_count(self):
-        return self.listings.filter(is_active=True).count()
+    @staticmethod
+    def count_active_listing(category_id, delta):
+        """
+        Adds delta to the active listings counter of a category (if any).
+        """
+        if category_id is not None:
+            Category.objects.filter(pk=category_id).update(active_listings_count=F("active_listings_count") + delta)
 
 
 class Listing(models.Model):
@@ -27,10 +45,63 @@ class Listing(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     image_url = models.URLField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # summary of the bids, written along with each new bid (see Bid.save)
+    current_price = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    bid_count = models.PositiveIntegerField(default=0)
+    last_bid = models.ForeignKey("Bid", on_delete=models.SET_NULL, related_name="+", null=True, blank=True)
+
+    BIDS_SUMMARY_FIELDS = ["current_price", "bid_count", "last_bid"]
+
+    class Meta:
+        # pages of active listings, newest first (see pagination.listings_page): indexes of the active
+        # listings only, as databases like SQLite don't look up "WHERE is_active" in an index on is_active
+        indexes = [
+            models.Index(fields=["creation_date", "id"], condition=models.Q(is_active=True),
+                         name="listing_active_date_idx"),
+            models.Index(fields=["category", "creation_date", "id"], condition=models.Q(is_active=True),
+                         name="listing_category_date_idx"),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.user})"
 
+    def in_watchlist_of(self, user):
+        """
+        Returns whether the listing is in the watchlist of a user, looked up in the
+        watchlists index rather than loading the watchlist.
+        """
+        return user.is_authenticated and Watchlist.listings.through.objects.filter(
+            watchlist_id=user.pk, listing_id=self.pk).exists()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.current_price = self.starting_bid_dollars
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if self.is_active:
+                    Category.count_active_listing(self.category_id, 1)
+            return
+        # never overwrite the summary of bids placed since the listing was loaded
+        if kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.BIDS_SUMMARY_FIELDS]
+        if "is_active" in kwargs["update_fields"] or "category" in kwargs["update_fields"]:
+            with transaction.atomic():
+                # lock the listing row (like select_for_update, but also on SQLite) before reading
+                # the state replaced, so that closing a listing twice at once counts it once
+                Listing.objects.filter(pk=self.pk).update(is_active=F("is_active"))
+                was_active, category_id = Listing.objects.values_list("is_active", "category_id").get(pk=self.pk)
+                super().save(*args, **kwargs)
+                if (was_active, category_id) != (self.is_active, self.category_id):
+                    if was_active:
+                        Category.count_active_listing(category_id, -1)
+                    if self.is_active:
+                        Category.count_active_listing(self.category_id, 1)
+        else:
+            super().save(*args, **kwargs)
+        if "starting_bid_dollars" in kwargs["update_fields"]:
+            Listing.objects.filter(pk=self.pk, bid_count=0).update(current_price=self.starting_bid_dollars)
+
 
 class Bid(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bids")
@@ -41,6 +112,34 @@ class Bid(models.Model):
     def __str__(self):
         return f"{self.user} offers {self.amount_dollars} for {self.listing}"
 
+    def clean(self):
+        if self.listing_id is not None and self._state.adding and self.amount_dollars is not None:
+            listing = Listing.objects.get(pk=self.listing_id)
+            if not listing.is_active:
+                raise ValidationError("Auction is closed")
+            if self.amount_dollars <= listing.current_price:
+                raise ValidationError("Bid must be greater than current price")
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        # prices only increase: a bid not greater than the price of the listing already loaded
+        # is rejected without waiting for the listing row lock
+        if Bid.listing.is_cached(self) and self.amount_dollars <= self.listing.current_price:
+            raise BidRejected(f"{self.amount_dollars} is not greater than the price of listing {self.listing_id}")
+        # Compare-and-swap on the listing price: the bid is placed only if it is still greater
+        # when written. The update locks the listing row until the transaction ends, so bids
+        # on a listing are placed one at a time, and the price only increases.
+        with transaction.atomic():
+            placed = Listing.objects.filter(
+                pk=self.listing_id, is_active=True, current_price__lt=self.amount_dollars
+            ).update(current_price=self.amount_dollars, bid_count=F("bid_count") + 1)
+            if not placed:
+                raise BidRejected(f"{self.amount_dollars} is not greater than the price of listing {self.listing_id}")
+            super().save(*args, **kwargs)
+            Listing.objects.filter(pk=self.listing_id).update(last_bid=self)
+
 
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
@@ -60,6 +159,12 @@ class Watchlist(models.Model):
         return f"{self.user}'s"
 
 
+@receiver(post_delete, sender=Listing)
+def uncount_deleted_listing(sender, instance, **kwargs):
+    if instance.is_active:
+        Category.count_active_listing(instance.category_id, -1)
+
+
 class NewListingForm(ModelForm):
     # sort categories by name
     def __init__(self, *args, **kwargs):
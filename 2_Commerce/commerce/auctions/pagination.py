@@ -0,0 +1,59 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+# Listings are shown newest first, id breaking ties between listings created at the same time
+LISTINGS_ORDER = ["-creation_date", "-id"]
+
+# Largest id of a listing (64-bit integer)
+MAX_ID = 2 ** 63 - 1
+
+
+def encode_cursor(listing):
+    """
+    Returns the opaque cursor of the listings following the given one.
+    """
+    position = f"{listing.creation_date.isoformat()}|{listing.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (creation date, id) position encoded in a cursor, or None if it is not a valid cursor.
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        creation_date, listing_id = base64.urlsafe_b64decode(cursor + padding).decode().split("|")
+        creation_date, listing_id = datetime.fromisoformat(creation_date), int(listing_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    # ids the database can't compare with
+    if not 0 <= listing_id <= MAX_ID:
+        return None
+    return creation_date, listing_id
+
+
+def listings_page(listings, cursor=None, page_size=None):
+    """
+    Returns a page of listings, newest first, following the cursor position (the first page without
+    cursor), and the cursor of the next page (None on the last page).
+
+    Pages are selected by the position of their first listing rather than by offset (keyset
+    pagination), so that the database seeks them in the (creation date, id) order of an index
+    instead of skipping all the listings of the previous pages.
+    """
+    page_size = page_size or settings.AUCTIONS_PAGE_SIZE
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        creation_date, listing_id = position
+        # (creation date, id) < position, with a range on the creation date the index is sought by
+        listings = listings.filter(Q(creation_date__lte=creation_date),
+                                   Q(creation_date__lt=creation_date) | Q(id__lt=listing_id))
+    # one more listing tells whether there is a next page
+    page = list(listings.order_by(*LISTINGS_ORDER)[:page_size + 1])
+    if len(page) > page_size:
+        return page[:page_size], encode_cursor(page[page_size - 1])
+    return page, None
@@ -1,3 +1,330 @@
-from django.test import TestCase
+import base64
+import io
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Bid, BidRejected, Category, Listing, User, Watchlist
+from .pagination import LISTINGS_ORDER, decode_cursor, encode_cursor
+
+
+class AuctionsTestCase(TestCase):
+
+    def setUp(self):
+        self.seller = User.objects.create_user("seller", password="password")
+        self.bidder = User.objects.create_user("bidder", password="password")
+        self.category = Category.objects.create(name="Books")
+
+    def create_listing(self, title="Book", starting_bid="10.00", **kwargs):
+        kwargs.setdefault("category", self.category)
+        return Listing.objects.create(user=self.seller, title=title, starting_bid_dollars=Decimal(starting_bid),
+                                      **kwargs)
+
+    def place_bid(self, listing, amount, user=None):
+        return Bid.objects.create(user=user or self.bidder, listing=listing, amount_dollars=Decimal(amount))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+
+class BidsSummaryTestCase(AuctionsTestCase):
+
+    def test_new_listing_price(self):
+        """New listings are priced at their starting bid"""
+        listing = self.create_listing(starting_bid="12.50")
+        self.assertEqual(listing.current_price, Decimal("12.50"))
+        self.assertEqual(listing.bid_count, 0)
+        self.assertIsNone(listing.last_bid)
+
+    def test_bid_updates_listing(self):
+        """Placing a bid must update the listing price, bid count and last bid"""
+        listing = self.create_listing()
+        self.place_bid(listing, "11.00")
+        bid = self.place_bid(listing, "15.00")
+        listing.refresh_from_db()
+        self.assertEqual(listing.current_price, Decimal("15.00"))
+        self.assertEqual(listing.bid_count, 2)
+        self.assertEqual(listing.last_bid, bid)
+
+    def test_stale_listing_save_keeps_bids(self):
+        """Saving a listing loaded before a bid must not overwrite its bids summary"""
+        listing = self.create_listing()
+        stale = Listing.objects.get(pk=listing.pk)
+        self.place_bid(listing, "11.00")
+        stale.title = "Rare book"
+        stale.save()
+        listing.refresh_from_db()
+        self.assertEqual((listing.title, listing.bid_count, listing.current_price), ("Rare book", 1, Decimal("11.00")))
+
+    def test_starting_bid_change(self):
+        """Changing the starting bid must reprice listings without bids only"""
+        listing = self.create_listing()
+        listing.starting_bid_dollars = Decimal("20.00")
+        listing.save()
+        listing.refresh_from_db()
+        self.assertEqual(listing.current_price, Decimal("20.00"))
+
+        self.place_bid(listing, "25.00")
+        listing.starting_bid_dollars = Decimal("5.00")
+        listing.save()
+        listing.refresh_from_db()
+        self.assertEqual(listing.current_price, Decimal("25.00"))
+
+    def test_bid_view_uses_current_price(self):
+        listing = self.create_listing()
+        self.place_bid(listing, "15.00")
+        self.client.login(username="bidder", password="password")
+        response = self.client.post(f"/listings/{listing.id}/bid", {"amount_dollars": "14.00"})
+        self.assertContains(response, "Bid must be greater than current price")
+        self.client.post(f"/listings/{listing.id}/bid", {"amount_dollars": "16.00"})
+        listing.refresh_from_db()
+        self.assertEqual((listing.current_price, listing.bid_count), (Decimal("16.00"), 2))
+
+    def test_backfill(self):
+        """Backfill must compute the bids summary of every listing from its bids, the highest being current"""
+        with_bids = self.create_listing()
+        self.place_bid(with_bids, "11.00")
+        last_bid = self.place_bid(with_bids, "12.00")
+        without_bids = self.create_listing()
+        # a lower bid placed afterwards under the former race, bypassing the price check
+        legacy = self.create_listing()
+        highest_bid = self.place_bid(legacy, "15.00")
+        Bid.objects.bulk_create([Bid(user=self.bidder, listing=legacy, amount_dollars=Decimal("13.00"))])
+        Listing.objects.update(current_price=0, bid_count=0, last_bid=None)
+
+        call_command("auctions_backfill_bids", "--batch-size", "1", stdout=io.StringIO())
+        with_bids.refresh_from_db()
+        without_bids.refresh_from_db()
+        self.assertEqual((with_bids.current_price, with_bids.bid_count, with_bids.last_bid),
+                         (Decimal("12.00"), 2, last_bid))
+        self.assertEqual((without_bids.current_price, without_bids.bid_count, without_bids.last_bid),
+                         (Decimal("10.00"), 0, None))
+        legacy.refresh_from_db()
+        self.assertEqual((legacy.current_price, legacy.bid_count, legacy.last_bid),
+                         (Decimal("15.00"), 2, highest_bid))
+
+    def test_listing_pages_constant_queries(self):
+        """Index and listing pages must take the same number of queries whatever the number of bids and listings"""
+        listing = self.create_listing()
+        self.client.login(username="bidder", password="password")
+        index_queries = self.count_queries("/")
+        listing_queries = self.count_queries(f"/listings/{listing.id}")
+        for i in range(5):
+            self.place_bid(self.create_listing(title=f"Book {i}"), "11.00")
+            self.place_bid(listing, f"{11 + i}.00")
+        self.assertEqual(self.count_queries("/"), index_queries)
+        self.assertEqual(self.count_queries(f"/listings/{listing.id}"), listing_queries)
+
+    def test_current_bid_message(self):
+        listing = self.create_listing()
+        self.assertNotContains(self.client.get(f"/listings/{listing.id}"), "Your bid is the current bid")
+        self.place_bid(listing, "11.00")
+        self.client.login(username="bidder", password="password")
+        self.assertContains(self.client.get(f"/listings/{listing.id}"), "Your bid is the current bid")
+
+
+class BidEngineTestCase(AuctionsTestCase):
+
+    def test_stale_bid_rejected(self):
+        """A bid not greater than the price when saved must be rejected, even if it was greater when read"""
+        listing = self.create_listing()
+        seen = Listing.objects.get(pk=listing.pk)
+        self.place_bid(listing, "15.00")
+        with self.assertRaises(BidRejected):
+            self.place_bid(seen, "12.00")
+        listing.refresh_from_db()
+        self.assertEqual((listing.current_price, listing.bid_count), (Decimal("15.00"), 1))
+        self.assertEqual(Bid.objects.count(), 1)
+
+    def test_bid_on_closed_listing_rejected(self):
+        listing = self.create_listing()
+        Listing.objects.filter(pk=listing.pk).update(is_active=False)
+        with self.assertRaises(BidRejected):
+            self.place_bid(listing, "50.00")
+
+    def test_equal_bid_rejected(self):
+        listing = self.create_listing()
+        with self.assertRaises(BidRejected):
+            self.place_bid(listing, "10.00")
+
+    def test_outbid_view(self):
+        """Bid view must show the current price to a bidder outbid since loading the listing"""
+        listing = self.create_listing()
+        self.place_bid(listing, "30.00", user=self.seller)
+        self.client.login(username="bidder", password="password")
+        response = self.client.post(f"/listings/{listing.id}/bid", {"amount_dollars": "20.00"})
+        self.assertContains(response, "Bid must be greater than current price")
+        self.assertContains(response, "$30.00")
+
+    def test_closed_listing_view(self):
+        listing = self.create_listing()
+        Listing.objects.filter(pk=listing.pk).update(is_active=False)
+        self.client.login(username="bidder", password="password")
+        self.assertContains(self.client.post(f"/listings/{listing.id}/bid", {"amount_dollars": "20.00"}),
+                            "Auction is closed")
+
+
+class CategoryCountersTestCase(AuctionsTestCase):
+
+    def count(self, category=None):
+        return Category.objects.get(pk=(category or self.category).pk).active_listings_count
+
+    def test_create_and_close(self):
+        """Creating and closing listings must update the active listings counter of their category"""
+        self.client.login(username="seller", password="password")
+        self.client.post("/listings/create", {"category": self.category.id, "title": "Book",
+                                              "starting_bid_dollars": "10"})
+        listing = self.create_listing()
+        self.create_listing(category=None)
+        self.assertEqual(self.count(), 2)
+        self.client.post(f"/listings/{listing.id}/close")
+        # closing again changes nothing
+        self.client.post(f"/listings/{listing.id}/close")
+        self.assertEqual(self.count(), 1)
+
+    def test_move_and_delete(self):
+        other = Category.objects.create(name="Toys")
+        listing = self.create_listing()
+        listing.category = other
+        listing.save()
+        self.assertEqual((self.count(), self.count(other)), (0, 1))
+        listing.delete()
+        self.assertEqual(self.count(other), 0)
+
+    def test_categories_page_counts_no_listing(self):
+        """Categories page must show the counters in a single query on categories"""
+        self.create_listing()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/categories")
+        self.assertContains(response, "(1)")
+        self.assertFalse([query for query in queries if "auctions_listing" in query["sql"]])
+
+    def test_recount(self):
+        """Recount must set the counters to the number of active listings of each category"""
+        self.create_listing()
+        self.create_listing(is_active=False)
+        Category.objects.update(active_listings_count=0)
+        call_command("auctions_count_listings", stdout=io.StringIO())
+        self.assertEqual(self.count(), 1)
+
+
+class WatchlistTestCase(AuctionsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.listing = self.create_listing()
+        self.client.login(username="bidder", password="password")
+
+    def watch(self, action, listing=None):
+        return self.client.post("/watchlist", {"listing_id": (listing or self.listing).id, "watchlist": action,
+                                               "from_url": "/"})
+
+    def test_add_and_remove(self):
+        """Listing page must show whether the listing is in the user watchlist"""
+        self.assertContains(self.client.get(f"/listings/{self.listing.id}"), 'value="add"')
+        self.watch("add")
+        self.assertContains(self.client.get(f"/listings/{self.listing.id}"), 'value="remove"')
+        self.assertEqual(self.client.get("/watchlist").context["listings"], [self.listing])
+        self.watch("remove")
+        self.assertContains(self.client.get(f"/listings/{self.listing.id}"), 'value="add"')
+        self.assertEqual(self.client.get("/watchlist").context["listings"], [])
+
+    def test_watchlist_created_once(self):
+        """Watchlist must be created when a first listing is added to it, and only then"""
+        self.client.get("/watchlist")
+        self.watch("remove")
+        self.assertFalse(Watchlist.objects.exists())
+        self.watch("add")
+        self.watch("add", self.create_listing(title="Other"))
+        self.assertEqual(Watchlist.objects.get().listings.count(), 2)
+
+    def test_membership_queries(self):
+        """Listing page must look the listing up in the watchlist rather than load the watchlist"""
+        self.watch("add")
+        Listing.objects.bulk_create(Listing(user=self.seller, title=f"Book {i}") for i in range(200))
+        self.bidder.watchlist.listings.add(*Listing.objects.exclude(pk=self.listing.pk))
+        with CaptureQueriesContext(connection) as captured:
+            self.assertContains(self.client.get(f"/listings/{self.listing.id}"), 'value="remove"')
+        watchlist_loads = [query["sql"] for query in captured
+                           if "auctions_watchlist_listings" in query["sql"]
+                           and "COUNT(" not in query["sql"] and "LIMIT 1" not in query["sql"]]
+        self.assertEqual(watchlist_loads, [])
+
+    def test_anonymous_listing_page(self):
+        self.client.logout()
+        response = self.client.get(f"/listings/{self.listing.id}")
+        self.assertFalse(response.context["in_watchlist"])
+
+
+class BenchmarkTestCase(TransactionTestCase):
+
+    def test_concurrent_bidders(self):
+        """Concurrent bidders must place bids at strictly increasing prices, the benchmark cleaning up after itself"""
+        out = io.StringIO()
+        call_command("auctions_bench", "bids", "--bidders", "20", "--bids", "3", stdout=out)
+        self.assertIn("placed at strictly increasing prices", out.getvalue())
+        self.assertFalse(Listing.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+    def test_pages_benchmark(self):
+        """Pages benchmark must time cursor and offset pages, the benchmark cleaning up after itself"""
+        out = io.StringIO()
+        call_command("auctions_bench", "pages", "--listings", "50", "--repeat", "1", stdout=out)
+        self.assertIn("by cursor", out.getvalue())
+        self.assertFalse(Listing.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+@override_settings(AUCTIONS_PAGE_SIZE=3)
+class PaginationTestCase(AuctionsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # listings created at the same time must still be paginated in a stable order
+        now = timezone.now()
+        self.listings = [self.create_listing(title=f"Book {i}") for i in range(7)]
+        Listing.objects.filter(pk__in=[listing.pk for listing in self.listings[2:5]]).update(creation_date=now)
+        Listing.objects.filter(pk=self.listings[6].pk).update(is_active=False)
+
+    def titles(self, url):
+        response = self.client.get(url)
+        return [listing.title for listing in response.context["listings"]], response.context["next_cursor"]
+
+    def test_pages(self):
+        """Pages must list every active listing once, newest first, the last page having no next cursor"""
+        titles, cursor = self.titles("/")
+        pages = [titles]
+        while cursor:
+            titles, cursor = self.titles(f"/?after={cursor}")
+            pages.append(titles)
+        expected = [listing.title for listing in Listing.objects.filter(is_active=True).order_by(*LISTINGS_ORDER)]
+        self.assertEqual([len(page) for page in pages], [3, 3])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_invalid_cursor(self):
+        """An invalid cursor must show the first page"""
+        first_page = self.titles("/")[0]
+        self.assertEqual(self.titles("/?after=invalid")[0], first_page)
+        for position in ["2020-01-01T00:00:00+00:00|99999999999999999999", "2020-01-01T00:00:00+00:00|-1"]:
+            cursor = base64.urlsafe_b64encode(position.encode()).decode()
+            self.assertEqual(self.titles(f"/?after={cursor}")[0], first_page)
+
+    def test_category_and_watchlist_pages(self):
+        self.client.login(username="bidder", password="password")
+        Watchlist.objects.create(user=self.bidder).listings.add(*self.listings)
+        titles, cursor = self.titles("/watchlist")
+        self.assertEqual(len(titles), 3)
+        self.assertContains(self.client.get("/watchlist"), f"?after={cursor}")
+        titles, cursor = self.titles(f"/categories/{self.category.id}")
+        self.assertEqual(len(titles), 3)
+        self.assertIsNotNone(cursor)
+
+    def test_cursor_roundtrip(self):
+        listing = Listing.objects.get(pk=self.listings[0].pk)
+        self.assertEqual(decode_cursor(encode_cursor(listing)), (listing.creation_date, listing.id))
@@ -1,17 +1,21 @@
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.db import IntegrityError
+from django.db.models import Prefetch
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotAllowed
 from django.shortcuts import render
 from django.urls import reverse
 
 from .models import *
+from .pagination import listings_page
 
 
 def index(request):
-    # render list of active listings
+    # render a page of active listings
+    listings, next_cursor = listings_page(Listing.objects.filter(is_active=True), request.GET.get("after"))
     return render(request, "auctions/index.html", {
-        "listings": Listing.objects.filter(is_active=True).order_by("creation_date").reverse()
+        "listings": listings,
+        "next_cursor": next_cursor
     })
 
 
@@ -89,8 +93,11 @@ def create(request):
 
 
 def listing_view(request, listing_id):
+    listing = Listing.objects.select_related("user", "category", "last_bid").prefetch_related(
+        Prefetch("comments", queryset=Comment.objects.select_related("user"))).get(pk=listing_id)
     return render(request, "auctions/listing.html", {
-        "listing": Listing.objects.get(pk=listing_id),
+        "listing": listing,
+        "in_watchlist": listing.in_watchlist_of(request.user),
         "bid_form": NewBidForm(),
         "comment_form": NewCommentForm()
     })
@@ -103,27 +110,28 @@ def bid(request, listing_id):
 
         bid_form = NewBidForm(request.POST)
         if bid_form.is_valid():
-            bid_amount = bid_form.cleaned_data["amount_dollars"]
-            current_price = listing.bids.last().amount_dollars if listing.bids.count() else listing.starting_bid_dollars
-            if bid_amount > current_price:
-                # bid is ok. Set user and listing, then save it
-                new_bid = bid_form.save(commit=False)
-                new_bid.user = request.user
-                new_bid.listing = listing
+            # bid is placed only if still greater than the current price when saved
+            new_bid = bid_form.save(commit=False)
+            new_bid.user = request.user
+            new_bid.listing = listing
+            try:
                 new_bid.save()
                 return HttpResponseRedirect(reverse("listing", args=(listing.id,)))
-            else:
-                # bad bid
+            except BidRejected:
+                # bad bid, or outbid meanwhile: show the current price
+                listing.refresh_from_db()
                 return render(request, "auctions/listing.html", {
                     "listing": listing,
+                    "in_watchlist": listing.in_watchlist_of(request.user),
                     "bid_form": bid_form,
-                    "message": "Bid must be greater than current price",
+                    "message": "Bid must be greater than current price" if listing.is_active else "Auction is closed",
                     "comment_form": NewCommentForm()
                 })
         else:
             # send bid_form back to the user, it will display the error
             return render(request, "auctions/listing.html", {
                 "listing": listing,
+                "in_watchlist": listing.in_watchlist_of(request.user),
                 "bid_form": bid_form,
                 "comment_form": NewCommentForm()
             })
@@ -137,7 +145,7 @@ def close(request, listing_id):
         listing = Listing.objects.get(pk=listing_id)
         if request.user == listing.user:
             listing.is_active = False
-            listing.save()
+            listing.save(update_fields=["is_active"])
             return HttpResponseRedirect(reverse("listing", args=(listing.id, )))
     else:
         return HttpResponseNotAllowed(["POST"])
@@ -157,6 +165,7 @@ def comment(request, listing_id):
         else:
             return render(request, "auctions/listing.html", {
                 "listing": listing,
+                "in_watchlist": listing.in_watchlist_of(request.user),
                 "bid_form": NewBidForm(),
                 "comment_form": comment_form,
             })
@@ -167,30 +176,31 @@ def comment(request, listing_id):
 @login_required
 def watchlist(request):
     user = request.user
-    # create user watchlist if it doesn't exists
-    if not hasattr(user, "watchlist"):
-        new_watchlist = Watchlist(user=user)
-        new_watchlist.save()
 
     if request.method == "POST":
         listing = Listing.objects.get(pk=request.POST["listing_id"])
 
         # add or remove listing to/from watchlist
         if request.POST["watchlist"] == "add":
-            user.watchlist.listings.add(listing)
+            # create user watchlist when the first listing is added to it
+            user_watchlist, _ = Watchlist.objects.get_or_create(user=user)
+            user_watchlist.listings.add(listing)
         else:  # remove
-            user.watchlist.listings.remove(listing)
+            Watchlist.listings.through.objects.filter(watchlist_id=user.pk, listing=listing).delete()
 
         # redirect to original page
         return HttpResponseRedirect(request.POST["from_url"])
     else:
-        # render listings in user watchlist
+        # render a page of listings in user watchlist (if any)
+        listings, next_cursor = listings_page(Listing.objects.filter(in_watchlists=user.pk), request.GET.get("after"))
         return render(request, "auctions/index.html", {
-            "listings": user.watchlist.listings.all().order_by("creation_date").reverse()
+            "listings": listings,
+            "next_cursor": next_cursor
         })
 
 
 def categories_index(request):
+    # categories keep count of their active listings
     return render(request, "auctions/categories.html", {
         "categories": Category.objects.all()
     })
@@ -198,8 +208,10 @@ def categories_index(request):
 
 def category(request, category_id):
     c = Category.objects.get(pk=category_id)
-    # render a list of all active listings in the category
+    # render a page of active listings in the category
+    listings, next_cursor = listings_page(c.listings.filter(is_active=True), request.GET.get("after"))
     return render(request, "auctions/index.html", {
         "category_name": c.name,
-        "listings": c.listings.filter(is_active=True).order_by("creation_date").reverse()
+        "listings": listings,
+        "next_cursor": next_cursor
     })
@@ -78,6 +78,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # in a file rather than in memory, so that tests can use concurrent connections
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -124,3 +128,9 @@ STATIC_URL = '/static/'
 LOGIN_URL = '/login'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# Auctions
+
+# Number of listings per page
+AUCTIONS_PAGE_SIZE = 20